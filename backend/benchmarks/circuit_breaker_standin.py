@@ -0,0 +1,99 @@
+"""
+Exercise a circuit breaker against a local stand-in dependency that injects
+latency and failures, and compare caller latency with and without the breaker.
+
+Run from the repository root:
+    python -m backend.benchmarks.circuit_breaker_standin
+"""
+import asyncio
+import os
+import random
+import statistics
+import time
+
+# Settings require Supabase credentials even though nothing here talks to Supabase
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark")
+
+from ..services.circuit_breaker import CircuitBreaker, CircuitOpenError, DependencyTimeout
+
+CALL_TIMEOUT = 0.5
+CALLS_PER_PHASE = 60
+
+
+class StandInDependency:
+    """Answers after `latency` seconds, failing with probability `failure_rate`"""
+
+    def __init__(self):
+        self.latency = 0.01
+        self.failure_rate = 0.0
+
+    async def request(self):
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ConnectionError("injected failure")
+        return "ok"
+
+
+PHASES = (
+    ("healthy", 0.01, 0.0),
+    ("degraded", 2.0, 0.5),
+    ("recovered", 0.01, 0.0),
+)
+
+
+async def run(use_breaker: bool):
+    dependency = StandInDependency()
+    breaker = CircuitBreaker(
+        name="stand-in",
+        failure_threshold=5,
+        reset_timeout=1.0,
+        call_timeout=CALL_TIMEOUT
+    )
+
+    async def call():
+        if use_breaker:
+            return await breaker.call(dependency.request)
+        return await asyncio.wait_for(dependency.request(), timeout=CALL_TIMEOUT)
+
+    for phase, latency, failure_rate in PHASES:
+        dependency.latency = latency
+        dependency.failure_rate = failure_rate
+        outcomes = {'ok': 0, 'error': 0, 'timeout': 0, 'fast_fail': 0}
+        latencies = []
+
+        for _ in range(CALLS_PER_PHASE):
+            started = time.perf_counter()
+            try:
+                await call()
+                outcomes['ok'] += 1
+            except CircuitOpenError:
+                outcomes['fast_fail'] += 1
+            except (DependencyTimeout, asyncio.TimeoutError):
+                outcomes['timeout'] += 1
+            except ConnectionError:
+                outcomes['error'] += 1
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.02)
+
+        print(
+            f"  {phase:<10} p50={statistics.median(latencies) * 1000:7.1f} ms  "
+            f"total={sum(latencies):6.2f} s  {outcomes}"
+            + (f"  state={breaker.state}" if use_breaker else "")
+        )
+
+    if use_breaker:
+        print(f"  breaker stats: {breaker.get_stats()}")
+
+
+async def main():
+    random.seed(7)
+    print("without breaker:")
+    await run(use_breaker=False)
+    print("with breaker:")
+    await run(use_breaker=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""
+Benchmark: PDF size with the standard vs compact output profile
+
+Run from the repository root:
+    python -m backend.benchmarks.compact_pdf
+"""
+import asyncio
+import io
+import os
+import tempfile
+import time
+
+# Settings require Supabase credentials even though nothing here talks to Supabase
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark")
+
+from PIL import Image
+
+from ..services.pdf_service import PDFService, STANDARD, COMPACT
+
+ITERATIONS = 5
+
+
+def make_logo(path: str):
+    """A large photographic-ish logo, like the ones users upload"""
+    width, height = 2400, 960
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    image = Image.blend(image, Image.linear_gradient('L').resize((width, height)).convert('RGB'), 0.5)
+    image.save(path, format='PNG')
+
+
+async def render(service: PDFService, invoice_data, template, profile, logo_url):
+    started = time.perf_counter()
+    path = await service._render_pdf(invoice_data, template, profile, logo_url)
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    os.unlink(path)
+    return size, elapsed
+
+
+async def main():
+    service = PDFService()
+    invoice_data = service.get_sample_invoice_data()
+    invoice_data.line_items = invoice_data.line_items * 20
+
+    with tempfile.TemporaryDirectory() as tmp:
+        logo_path = os.path.join(tmp, 'logo.png')
+        make_logo(logo_path)
+        logo_url = f"file://{logo_path}"
+        template = {'layout_json': {'logo_url': logo_url}}
+
+        with open(logo_path, 'rb') as f:
+            compact_logo = service._downsample_logo(f.read())
+
+        results = {}
+        for profile, logo in ((STANDARD, logo_url), (COMPACT, compact_logo)):
+            sizes, times = [], []
+            for _ in range(ITERATIONS):
+                size, elapsed = await render(service, invoice_data, template, profile, logo)
+                sizes.append(size)
+                times.append(elapsed)
+            results[profile] = (sizes[-1], sum(times) / len(times))
+
+    standard_bytes, standard_time = results[STANDARD]
+    compact_bytes, compact_time = results[COMPACT]
+    saved = standard_bytes - compact_bytes
+
+    print(f"standard: {standard_bytes:>10,} bytes  {standard_time * 1000:8.1f} ms/render")
+    print(f"compact:  {compact_bytes:>10,} bytes  {compact_time * 1000:8.1f} ms/render")
+    print(f"saved:    {saved:>10,} bytes  ({saved / standard_bytes:.1%})")
+    # Every invoice is uploaded, downloaded again and base64-encoded into an email
+    print(f"saved per sent invoice (upload + download + base64 attachment): {int(saved * (2 + 4 / 3)):,} bytes")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Benchmark: memory held by line items as dicts vs slotted LineItem records
+
+Run from the repository root:
+    python -m backend.benchmarks.invoice_models_memory
+"""
+import gc
+import time
+import tracemalloc
+
+from ..services.invoice_models import LineItem
+
+COUNTS = (10_000, 100_000, 500_000)
+
+
+def make_dict(i: int):
+    return {
+        'description': 'Oxygen Cylinder 40L',
+        'barcode': f"BC{i:07d}",
+        'serial_number': f"SN{i:07d}",
+        'rental_start_date': '2025-01-01',
+        'rental_days': 30,
+        'quantity': 1,
+        'unit_price': 5.0 + (i % 7),
+        'total_price': 150.0 + (i % 7) * 30,
+        'cylinder_id': None
+    }
+
+
+def make_record(i: int):
+    return LineItem(
+        description='Oxygen Cylinder 40L',
+        barcode=f"BC{i:07d}",
+        serial_number=f"SN{i:07d}",
+        rental_start_date='2025-01-01',
+        rental_days=30,
+        quantity=1,
+        unit_price=5.0 + (i % 7),
+        total_price=150.0 + (i % 7) * 30
+    )
+
+
+def measure(factory, count: int):
+    """Bytes retained by `count` items and seconds to build and total them"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    items = [factory(i) for i in range(count)]
+    if isinstance(items[0], dict):
+        total = sum(item['total_price'] for item in items)
+    else:
+        total = sum(item.total_price for item in items)
+    elapsed = time.perf_counter() - started
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return retained, elapsed, total
+
+
+def main():
+    for count in COUNTS:
+        dict_bytes, dict_time, _ = measure(make_dict, count)
+        record_bytes, record_time, _ = measure(make_record, count)
+        print(f"{count:>8,} line items")
+        print(f"  dict:      {dict_bytes / 1024 / 1024:8.1f} MiB  {dict_time * 1000:8.1f} ms")
+        print(f"  LineItem:  {record_bytes / 1024 / 1024:8.1f} MiB  {record_time * 1000:8.1f} ms")
+        print(f"  saved:     {(1 - record_bytes / dict_bytes) * 100:7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: hit rate of per-worker in-memory caches vs the host-wide shared cache
+
+Several worker processes look up preview-sized values with a skewed (Zipf-like)
+key distribution; a miss pays a simulated render and stores the result. Each
+scenario is also run a second time with fresh processes to show that the shared
+cache survives a worker restart.
+
+Run from the repository root:
+    python -m backend.benchmarks.shared_cache_workers
+"""
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark")
+
+from ..services.shared_cache import SharedCache, PREVIEWS
+
+WORKERS = 4
+LOOKUPS_PER_WORKER = 1_000
+DISTINCT_KEYS = 2_000
+VALUE_BYTES = 16 * 1024
+RENDER_SECONDS = 0.01
+# Same memory for the host either way: each worker's share, or one pool for all
+CACHE_ENTRIES = 128
+SHARED_MAX_BYTES = WORKERS * CACHE_ENTRIES * VALUE_BYTES
+
+
+def zipf_keys(seed: int, count: int):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(DISTINCT_KEYS)]
+    return rng.choices(range(DISTINCT_KEYS), weights=weights, k=count)
+
+
+def render(key: int) -> bytes:
+    time.sleep(RENDER_SECONDS)
+    return key.to_bytes(4, 'big') * (VALUE_BYTES // 4)
+
+
+def local_worker(seed: int, results):
+    cache: "OrderedDict[int, bytes]" = OrderedDict()
+    hits = 0
+    started = time.perf_counter()
+    for key in zipf_keys(seed, LOOKUPS_PER_WORKER):
+        if key in cache:
+            cache.move_to_end(key)
+            hits += 1
+            continue
+        cache[key] = render(key)
+        while len(cache) > CACHE_ENTRIES:
+            cache.popitem(last=False)
+    results.put((hits, time.perf_counter() - started))
+
+
+def shared_worker(seed: int, db_path: str, results):
+    cache = SharedCache(db_path, SHARED_MAX_BYTES)
+    hits = 0
+    started = time.perf_counter()
+    for key in zipf_keys(seed, LOOKUPS_PER_WORKER):
+        if cache.get(PREVIEWS, str(key)) is not None:
+            hits += 1
+            continue
+        cache.set(PREVIEWS, str(key), render(key))
+    results.put((hits, time.perf_counter() - started))
+
+
+def run_workers(target, extra_args, seed_base: int):
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=target, args=(seed_base + i, *extra_args, results))
+        for i in range(WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    hits = sum(h for h, _ in outcomes)
+    return hits / (WORKERS * LOOKUPS_PER_WORKER), max(t for _, t in outcomes)
+
+
+def report(label: str, hit_rate: float, elapsed: float):
+    print(f"  {label:<22} hit rate {hit_rate * 100:5.1f}%   slowest worker {elapsed:6.2f} s")
+
+
+def main():
+    data_dir = tempfile.mkdtemp(prefix="shared_cache_bench_")
+    db_path = os.path.join(data_dir, "shared_cache.sqlite3")
+    try:
+        print(f"{WORKERS} workers x {LOOKUPS_PER_WORKER:,} lookups over {DISTINCT_KEYS:,} keys")
+        print("per-worker memory:")
+        report("cold start", *run_workers(local_worker, (), 0))
+        report("after restart", *run_workers(local_worker, (), 100))
+        print("shared (SQLite):")
+        report("cold start", *run_workers(shared_worker, (db_path,), 0))
+        report("after restart", *run_workers(shared_worker, (db_path,), 100))
+
+        stats = SharedCache(db_path, SHARED_MAX_BYTES).get_stats()
+        print(f"  size {stats['bytes'] / 1024 / 1024:.1f} / {stats['max_bytes'] / 1024 / 1024:.1f} MiB")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: small organizations' render latency while a large one floods the queue
+
+One organization keeps its share of the render queue full (retrying when it is
+turned away), as during a month-end run; a few small organizations send one
+request at a time. The same load runs through a single FIFO queue (every
+request counted as one tenant, as before per-organization fairness) and through
+the per-organization round-robin with tenant caps. A last run has the large
+organization alone, to show the caps leave no slot idle.
+
+Run from the repository root:
+    python -m backend.benchmarks.tenant_fairness
+"""
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark")
+
+from ..services.admission import AdmissionController, AdmissionRejected, BATCH
+
+RENDER_SECONDS = 0.02
+DURATION_SECONDS = 5.0
+LARGE_TENANT_CLIENTS = 32
+SMALL_TENANTS = 4
+SMALL_TENANT_THINK_SECONDS = 0.05
+
+
+async def render(controller: AdmissionController, tenant: str) -> float:
+    started = time.perf_counter()
+    async with controller.slot(BATCH, tenant):
+        await asyncio.sleep(RENDER_SECONDS)
+    return time.perf_counter() - started
+
+
+async def large_tenant(controller: AdmissionController, tenant: str, deadline: float, done: list):
+    while time.perf_counter() < deadline:
+        try:
+            await render(controller, tenant)
+            done.append(1)
+        except AdmissionRejected:
+            await asyncio.sleep(0.005)
+
+
+async def small_tenant(controller: AdmissionController, tenant: str, deadline: float, latencies: list):
+    while time.perf_counter() < deadline:
+        try:
+            latencies.append(await render(controller, tenant))
+        except AdmissionRejected:
+            latencies.append(float('inf'))
+        await asyncio.sleep(SMALL_TENANT_THINK_SECONDS)
+
+
+async def run(fair: bool, small_tenants: int = SMALL_TENANTS):
+    controller = AdmissionController(
+        max_concurrent=2,
+        max_queue=16,
+        queue_timeout=30.0,
+        retry_after=5,
+        tenant_max_concurrent=1 if fair else None,
+        tenant_max_queue=8 if fair else None
+    )
+    deadline = time.perf_counter() + DURATION_SECONDS
+    large_done: list = []
+    latencies: list = []
+
+    def tenant(name: str) -> str:
+        return name if fair else "shared"
+
+    await asyncio.gather(
+        *(large_tenant(controller, tenant("large"), deadline, large_done) for _ in range(LARGE_TENANT_CLIENTS)),
+        *(small_tenant(controller, tenant(f"small-{i}"), deadline, latencies) for i in range(small_tenants))
+    )
+    return len(large_done), latencies
+
+
+def report(label: str, large_done: int, latencies: list):
+    served = sorted(t for t in latencies if t != float('inf'))
+    rejected = len(latencies) - len(served)
+    p95 = served[int(len(served) * 0.95) - 1] if served else 0.0
+    print(f"{label}:")
+    print(f"  large tenant renders:   {large_done:>6}")
+    print(f"  small tenant requests:  {len(latencies):>6}  ({rejected} rejected)")
+    if served:
+        print(f"  small tenant p50 / p95: {statistics.median(served) * 1000:6.1f} / {p95 * 1000:6.1f} ms")
+
+
+def main():
+    for fair in (False, True):
+        large_done, latencies = asyncio.run(run(fair))
+        report("per-organization round-robin" if fair else "single FIFO queue", large_done, latencies)
+    for fair in (False, True):
+        large_done, latencies = asyncio.run(run(fair, small_tenants=0))
+        report(
+            "large organization alone, " + ("round-robin" if fair else "FIFO"), large_done, latencies
+        )
+
+
+if __name__ == "__main__":
+    main()
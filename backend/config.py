@@ -2,7 +2,8 @@
 Configuration settings for the FastAPI backend
 """
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional, Dict, Any
+import os
 
 class Settings(BaseSettings):
     # Supabase
@@ -12,6 +13,7 @@ class Settings(BaseSettings):
     
     # Storage
     SUPABASE_STORAGE_BUCKET: str = "invoices"
+    PDF_CACHE_MAX_MB: int = 256
     
     # Email (SMTP)
     SMTP_HOST: Optional[str] = None
@@ -21,12 +23,101 @@ class Settings(BaseSettings):
     SMTP_FROM_EMAIL: Optional[str] = None
     SMTP_FROM_NAME: Optional[str] = "Gas Cylinder App"
     
+    # Circuit breakers and dependency timeouts
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    BREAKER_RESET_SECONDS: float = 30.0
+    SUPABASE_TIMEOUT_SECONDS: float = 10.0
+    STORAGE_TIMEOUT_SECONDS: float = 30.0
+    SMTP_TIMEOUT_SECONDS: float = 30.0
+    # Dedicated thread pools for the blocking Supabase client
+    SUPABASE_MAX_THREADS: int = 8
+    STORAGE_MAX_THREADS: int = 4
+    
+    # Email outbox
+    OUTBOX_MAX_ATTEMPTS: int = 8
+    OUTBOX_STATUS_MAX_ATTEMPTS: int = 8
+    OUTBOX_RETENTION_DAYS: int = 7
+    OUTBOX_BACKOFF_BASE_SECONDS: float = 30.0
+    OUTBOX_BACKOFF_MAX_SECONDS: float = 3600.0
+    OUTBOX_LEASE_SECONDS: float = 300.0
+    OUTBOX_POLL_SECONDS: float = 5.0
+    OUTBOX_BATCH_SIZE: int = 20
+    OUTBOX_CONCURRENCY: int = 4
+    OUTBOX_TENANT_MAX_CONCURRENCY: int = 3
+    
     # CORS
     CORS_ORIGINS: List[str] = ["http://localhost:5173", "http://localhost:5174", "http://localhost:3000"]
     
     # PDF Generation
     PDF_TEMPLATE_DIR: str = "backend/templates"
     
+    # PDF output profile: "standard" or "compact" (downsampled logo, recompressed and DPI-capped images)
+    PDF_OUTPUT_PROFILE: str = "compact"
+    PDF_IMAGE_DPI: int = 150
+    PDF_JPEG_QUALITY: int = 80
+    PDF_LOGO_MAX_WIDTH_PX: int = 400
+    PDF_LOGO_MAX_HEIGHT_PX: int = 160
+    
+    # Build invoices from the rental_accruals ledger when it covers the period
+    RENTAL_ACCRUALS_ENABLED: bool = True
+    
+    # Invoices fetched per page by the streaming export
+    EXPORT_PAGE_SIZE: int = 500
+    
+    # Invoice numbers reserved per round trip to invoice_settings
+    INVOICE_NUMBER_BLOCK_SIZE: int = 10
+    
+    # Render admission control
+    RENDER_MAX_CONCURRENCY: int = 2
+    RENDER_MAX_QUEUE: int = 16
+    RENDER_QUEUE_TIMEOUT_SECONDS: float = 30.0
+    RENDER_RETRY_AFTER_SECONDS: int = 5
+    
+    # Per-organization fairness for render and SMTP slots. Caps apply only while
+    # other organizations are waiting (0 = no cap); TENANT_WEIGHTS is a JSON map of
+    # organization_id -> round-robin weight (default 1)
+    RENDER_TENANT_MAX_CONCURRENCY: int = 1
+    RENDER_TENANT_MAX_QUEUE: int = 8
+    TENANT_WEIGHTS: Dict[str, int] = {}
+    
+    # Off-peak invoice scheduler. INVOICE_SCHEDULE_JOBS is a JSON list of
+    # {"organization_id", "window_start", "window_end", "max_per_minute", "day_of_month", "send", "template_id"};
+    # omitted keys fall back to the defaults below
+    INVOICE_SCHEDULER_ENABLED: bool = False
+    INVOICE_SCHEDULE_JOBS: List[Dict[str, Any]] = []
+    INVOICE_SCHEDULE_TIMEZONE: str = "UTC"
+    INVOICE_SCHEDULE_WINDOW_START: str = "01:00"
+    INVOICE_SCHEDULE_WINDOW_END: str = "05:00"
+    INVOICE_SCHEDULE_MAX_PER_MINUTE: float = 30
+    INVOICE_SCHEDULE_DAY_OF_MONTH: int = 1
+    INVOICE_SCHEDULE_SEND: bool = True
+    INVOICE_SCHEDULE_USER_ID: Optional[str] = None
+    INVOICE_SCHEDULE_POLL_SECONDS: float = 60.0
+    INVOICE_SCHEDULE_MAX_ATTEMPTS: int = 3
+    INVOICE_SCHEDULE_LEASE_SECONDS: float = 600.0
+    
+    # Readiness: warm up (template compile + throwaway render) before reporting ready
+    STARTUP_WARMUP: bool = True
+    STARTUP_WARMUP_RETRY_BASE_SECONDS: float = 5.0
+    STARTUP_WARMUP_RETRY_MAX_SECONDS: float = 300.0
+    READINESS_PROBE_TIMEOUT_SECONDS: float = 2.0
+    READINESS_PROBE_TTL_SECONDS: float = 10.0
+    
+    # Structured logging (JSON lines on stdout, written from a background thread)
+    LOG_LEVEL: str = "INFO"
+    LOG_SUCCESS_SAMPLE_RATE: float = 0.1
+    LOG_QUEUE_SIZE: int = 10000
+    
+    # Cache shared by all workers on the host (previews, logos, compiled templates)
+    SHARED_CACHE_MAX_MB: int = 128
+    
+    # Local state (SQLite stores)
+    LOCAL_DATA_DIR: str = os.path.join(os.path.dirname(__file__), "data")
+    
+    # Idempotency keys
+    IDEMPOTENCY_RETENTION_HOURS: int = 24
+    IDEMPOTENCY_LOCK_TIMEOUT_SECONDS: int = 300
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -6,14 +6,96 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
+import asyncio
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 import uuid
 
 from .routers import invoices, email
 from .config import settings
+from .services.admission import render_admission, smtp_admission
+from .services.single_flight import request_coalescer
+from .services.pdf_service import PDFService
+from .services.pdf_cache import pdf_cache, close_http_client
+from .services.shared_cache import shared_cache
+from .services.outbox import email_outbox, outbox_dispatcher
+from .services.circuit_breaker import get_breaker_stats
+from .services.invoice_numbers import invoice_number_allocator
+from .services.scheduler import invoice_scheduler
+from .services.readiness import warm_up, dependency_prober, render_saturation
+from .services import log
 
-app = FastAPI(title="Gas Cylinder Invoice API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log.setup_logging(
+        level=settings.LOG_LEVEL,
+        success_sample_rate=settings.LOG_SUCCESS_SAMPLE_RATE,
+        queue_size=settings.LOG_QUEUE_SIZE
+    )
+    warm_up.start(enabled=settings.STARTUP_WARMUP)
+    outbox_dispatcher.start()
+    if settings.INVOICE_SCHEDULER_ENABLED:
+        # Every worker starts it; job leases in the shared store let one run each job
+        invoice_scheduler.start()
+    yield
+    await warm_up.stop()
+    await invoice_scheduler.stop()
+    await outbox_dispatcher.stop()
+    await close_http_client()
+    log.shutdown_logging()
+
+app = FastAPI(title="Gas Cylinder Invoice API", version="1.0.0", lifespan=lifespan)
+
+request_logger = log.get_logger("http")
+
+class RequestContextMiddleware:
+    """
+    Binds a request id (X-Request-ID or a new one) for every log record of the
+    request, echoes it back, and logs the request's status and duration.
+    Written as plain ASGI so the route runs in this context and ids it binds
+    (such as the organization) show up on the completion event.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        
+        headers = dict(scope.get('headers') or [])
+        request_id = headers.get(b'x-request-id', b'').decode('latin-1')[:64] or uuid.uuid4().hex
+        log.bind(request_id=request_id)
+        started = time.perf_counter()
+        status_code = 500
+        
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                message.setdefault('headers', [])
+                message['headers'] = list(message['headers']) + [(b'x-request-id', request_id.encode('latin-1'))]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            # Errors are always logged, successful requests only when sampled
+            if status_code >= 500 or log.sampled():
+                log.log_event(
+                    request_logger,
+                    "request.completed",
+                    logging.WARNING if status_code >= 500 else logging.INFO,
+                    method=scope['method'],
+                    path=scope['path'],
+                    status=status_code,
+                    duration_ms=round((time.perf_counter() - started) * 1000, 1)
+                )
+
+app.add_middleware(RequestContextMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -36,6 +118,60 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness for load balancers: 503 until warm-up has finished (failed
+    attempts are retried in the background) or while the render queue is full. Dependency latencies are reported but only mark the
+    worker degraded, since every worker shares the same dependencies.
+    """
+    render = render_saturation()
+    dependencies = await dependency_prober.probe()
+    
+    is_ready = warm_up.ready and not render['queue_full']
+    if not is_ready:
+        status = "not_ready"
+    elif any(d['status'] not in ('ok', 'not_configured') for d in dependencies.values()):
+        status = "degraded"
+    else:
+        status = "ready"
+    
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={
+            "status": status,
+            "warm_up": warm_up.get_status(),
+            "render": render,
+            "dependencies": dependencies
+        }
+    )
+
+def _store_stats() -> Dict[str, Any]:
+    """Stats read from the SQLite stores; may wait on writers, so run off the event loop"""
+    return {
+        "pdf_cache": pdf_cache.get_stats(),
+        "shared_cache": shared_cache.get_stats(),
+        "email_outbox": email_outbox.get_stats(),
+        "scheduler": invoice_scheduler.get_stats()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    stores = await asyncio.to_thread(_store_stats)
+    return {
+        "render": render_admission.get_stats(),
+        "coalescing": request_coalescer.get_stats(),
+        "pdf_output": PDFService.get_render_stats(),
+        "pdf_cache": stores["pdf_cache"],
+        "shared_cache": stores["shared_cache"],
+        "email_outbox": stores["email_outbox"],
+        "smtp": smtp_admission.get_stats(),
+        "circuit_breakers": get_breaker_stats(),
+        "invoice_numbers": invoice_number_allocator.get_stats(),
+        "scheduler": stores["scheduler"],
+        "logging": log.get_stats()
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
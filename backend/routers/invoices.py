@@ -1,14 +1,23 @@
 """
 Invoice PDF Generation Router
 """
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 from datetime import date
-import uuid
 
 from ..services.pdf_service import PDFService
 from ..services.supabase_service import SupabaseService
+from ..services.admission import INTERACTIVE
+from ..services.errors import ServiceUnavailable
+from ..services.single_flight import request_coalescer
+from ..services.idempotency import idempotency_store
+from ..services.accruals import AccrualService
+from ..services.invoice_pipeline import InvoicePipeline
+from ..services.export_service import InvoiceExporter, InvalidCursor, decode_cursor, NDJSON
+from ..config import settings
+from ..services.log import bind
 from ..auth import verify_token
 
 router = APIRouter()
@@ -21,82 +30,132 @@ class GeneratePDFRequest(BaseModel):
     template_id: Optional[str] = None
     organization_id: str
 
+class AccrualRunRequest(BaseModel):
+    organization_id: str
+    through_date: Optional[date] = None
+
 class GeneratePDFResponse(BaseModel):
     pdf_url: str
     invoice_id: str
     invoice_number: str
     total_amount: float
 
+async def _generate_invoice_pdf(
+    request: GeneratePDFRequest,
+    user_id: str
+) -> GeneratePDFResponse:
+    """Fetch, render, upload and save an invoice"""
+    result = await InvoicePipeline().generate_invoice(
+        organization_id=request.organization_id,
+        customer_id=request.customer_id,
+        period_start=request.invoice_period_start,
+        period_end=request.invoice_period_end,
+        template_id=request.template_id,
+        user_id=user_id
+    )
+    
+    return GeneratePDFResponse(
+        pdf_url=result['pdf_url'],
+        invoice_id=result['invoice_id'],
+        invoice_number=result['invoice_number'],
+        total_amount=result['total_amount']
+    )
+
+async def _render_preview(
+    template_id: str,
+    organization_id: str
+) -> str:
+    """Render a template preview with sample data, returns the PDF path"""
+    supabase_service = SupabaseService()
+    pdf_service = PDFService()
+    
+    # Get template
+    template = await supabase_service.get_template(
+        organization_id=organization_id,
+        template_id=template_id
+    )
+    
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    
+    # Generate sample invoice data
+    sample_data = pdf_service.get_sample_invoice_data()
+    
+    # Generate preview PDF
+    return await pdf_service.generate_pdf(
+        invoice_data=sample_data,
+        template=template,
+        organization_id=organization_id,
+        priority=INTERACTIVE
+    )
+
+async def _render_preview_png(
+    template_id: str,
+    organization_id: str,
+    resolution: int
+) -> bytes:
+    """Render the first page of a template preview as PNG"""
+    supabase_service = SupabaseService()
+    pdf_service = PDFService()
+    
+    template = await supabase_service.get_template(
+        organization_id=organization_id,
+        template_id=template_id
+    )
+    
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    
+    return await pdf_service.generate_preview_png(
+        template=template,
+        resolution=resolution,
+        organization_id=organization_id
+    )
+
 @router.post("/generate-pdf")
 async def generate_pdf(
     request: GeneratePDFRequest,
-    authorization: str = Header(None)
+    authorization: str = Header(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
-    Generate PDF invoice using a template
+    Generate PDF invoice using a template.
+    Retries carrying the same Idempotency-Key replay the stored response.
     """
     try:
         # Verify authentication
         user_id = verify_token(authorization)
         if not user_id:
             raise HTTPException(status_code=401, detail="Unauthorized")
+        bind(organization_id=request.organization_id)
         
-        # Initialize services
-        supabase_service = SupabaseService()
-        pdf_service = PDFService()
-        
-        # Fetch invoice data
-        invoice_data = await supabase_service.get_invoice_data(
-            organization_id=request.organization_id,
-            customer_id=request.customer_id,
-            period_start=request.invoice_period_start,
-            period_end=request.invoice_period_end
-        )
-        
-        if not invoice_data:
-            raise HTTPException(status_code=404, detail="No invoice data found")
-        
-        # Fetch template
-        template = await supabase_service.get_template(
-            organization_id=request.organization_id,
-            template_id=request.template_id
-        )
-        
-        if not template:
-            raise HTTPException(status_code=404, detail="Template not found")
-        
-        # Generate PDF
-        pdf_path = await pdf_service.generate_pdf(
-            invoice_data=invoice_data,
-            template=template,
-            organization_id=request.organization_id
-        )
-        
-        # Upload to Supabase Storage
-        pdf_url = await supabase_service.upload_pdf(
-            file_path=pdf_path,
-            organization_id=request.organization_id,
-            invoice_number=invoice_data.get('invoice_number', f"INV-{uuid.uuid4().hex[:8]}")
-        )
-        
-        # Create or update invoice record
-        invoice_id = await supabase_service.save_invoice(
-            organization_id=request.organization_id,
-            invoice_data=invoice_data,
-            template_id=request.template_id,
-            pdf_url=pdf_url,
-            user_id=user_id
+        # Identical concurrent requests (double-clicks, retries) from the same
+        # user share one render; the saved invoice is attributed to that user
+        key = (
+            "generate-pdf",
+            user_id,
+            request.invoice_id or "",
+            request.organization_id,
+            request.customer_id,
+            request.invoice_period_start.isoformat(),
+            request.invoice_period_end.isoformat(),
+            request.template_id or ""
         )
-        
-        return GeneratePDFResponse(
-            pdf_url=pdf_url,
-            invoice_id=invoice_id,
-            invoice_number=invoice_data.get('invoice_number', ''),
-            total_amount=invoice_data.get('total_amount', 0)
+        return await idempotency_store.run(
+            scope=f"generate-pdf:{request.organization_id}",
+            key=idempotency_key,
+            payload=request.model_dump(),
+            fn=lambda: request_coalescer.do(key, lambda: _generate_invoice_pdf(request, user_id))
         )
         
     except HTTPException:
         raise
+    except ServiceUnavailable as e:
+        raise HTTPException(
+            status_code=503,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating PDF: {str(e)}")
 
@@ -104,36 +163,30 @@ async def generate_pdf(
 async def preview_template(
     template_id: str,
     organization_id: str,
+    preview_format: str = Query("pdf", alias="format", pattern="^(pdf|png)$"),
+    resolution: int = Query(96, ge=24, le=300),
     authorization: str = Header(None)
 ):
     """
-    Preview a template with sample data
+    Preview a template with sample data.
+    format=png returns only the first page as a thumbnail at the given DPI.
     """
     try:
         user_id = verify_token(authorization)
         if not user_id:
             raise HTTPException(status_code=401, detail="Unauthorized")
+        bind(organization_id=organization_id)
         
-        supabase_service = SupabaseService()
-        pdf_service = PDFService()
-        
-        # Get template
-        template = await supabase_service.get_template(
-            organization_id=organization_id,
-            template_id=template_id
-        )
-        
-        if not template:
-            raise HTTPException(status_code=404, detail="Template not found")
-        
-        # Generate sample invoice data
-        sample_data = pdf_service.get_sample_invoice_data()
+        if preview_format == "png":
+            png = await request_coalescer.do(
+                ("preview-png", organization_id, template_id, resolution),
+                lambda: _render_preview_png(template_id, organization_id, resolution)
+            )
+            return Response(content=png, media_type="image/png")
         
-        # Generate preview PDF
-        pdf_path = await pdf_service.generate_pdf(
-            invoice_data=sample_data,
-            template=template,
-            organization_id=organization_id
+        pdf_path = await request_coalescer.do(
+            ("preview", organization_id, template_id),
+            lambda: _render_preview(template_id, organization_id)
         )
         
         return FileResponse(
@@ -144,6 +197,101 @@ async def preview_template(
         
     except HTTPException:
         raise
+    except ServiceUnavailable as e:
+        raise HTTPException(
+            status_code=503,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating preview: {str(e)}")
 
+
+@router.post("/accruals/run")
+async def run_accruals(
+    request: AccrualRunRequest,
+    authorization: str = Header(None)
+):
+    """
+    Record daily rental charges for an organization up to through_date (default today).
+    Only days since the last run are accrued.
+    """
+    try:
+        user_id = verify_token(authorization)
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        bind(organization_id=request.organization_id)
+        
+        supabase_service = SupabaseService()
+        accrual_service = AccrualService(supabase_service.client)
+        
+        return await accrual_service.accrue_organization(
+            organization_id=request.organization_id,
+            through=request.through_date
+        )
+        
+    except HTTPException:
+        raise
+    except ServiceUnavailable as e:
+        raise HTTPException(
+            status_code=503,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error accruing rentals: {str(e)}")
+
+
+@router.get("/export")
+async def export_invoices(
+    organization_id: str,
+    start_date: date,
+    end_date: date,
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    cursor: Optional[str] = None,
+    authorization: str = Header(None)
+):
+    """
+    Stream every invoice dated in [start_date, end_date] with its line items,
+    as NDJSON (one invoice per line) or CSV (one row per line item).
+    Each row carries a cursor; pass the last one received to resume right after that row.
+    """
+    try:
+        user_id = verify_token(authorization)
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        bind(organization_id=organization_id)
+        
+        try:
+            resume = decode_cursor(cursor) if cursor else None
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        supabase_service = SupabaseService()
+        exporter = InvoiceExporter(supabase_service.client, page_size=settings.EXPORT_PAGE_SIZE)
+        
+        # Fetch the first page up front so dependency errors still map to a status code
+        first_page = await exporter.fetch_page(organization_id, start_date, end_date, resume)
+        
+        return StreamingResponse(
+            exporter.stream(
+                organization_id=organization_id,
+                start_date=start_date,
+                end_date=end_date,
+                export_format=export_format,
+                cursor=resume,
+                first_page=first_page
+            ),
+            media_type="application/x-ndjson" if export_format == NDJSON else "text/csv"
+        )
+        
+    except HTTPException:
+        raise
+    except ServiceUnavailable as e:
+        raise HTTPException(
+            status_code=503,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error exporting invoices: {str(e)}")
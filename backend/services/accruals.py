@@ -0,0 +1,150 @@
+"""
+Incremental daily rental accrual ledger
+"""
+from datetime import date, timedelta
+from typing import Optional, Dict, Any, List
+from supabase import Client
+from .circuit_breaker import supabase_breaker
+
+PAGE_SIZE = 1000
+
+
+def daily_rate(rental: Dict[str, Any]) -> float:
+    """Daily charge for a rental row"""
+    rate = float(rental.get('rental_amount') or rental.get('daily_rate') or 0)
+    if rental.get('billing_frequency') == 'yearly':
+        rate = rate / 365  # Convert yearly to daily
+    return rate
+
+
+class AccrualService:
+    """
+    Records one charge per rental per day in rental_accruals. Each run only
+    covers the days since the rental's cursor, so the work is spread over the
+    month and invoices become an aggregate read.
+    """
+
+    def __init__(self, client: Client):
+        self.client = client
+
+    async def _execute(self, query):
+        return await supabase_breaker.call_sync(query.execute)
+
+    async def accrue_organization(
+        self,
+        organization_id: str,
+        through: Optional[date] = None
+    ) -> Dict[str, Any]:
+        """Accrue every active rental of an organization up to and including `through`"""
+        through = through or date.today()
+        rentals_seen = 0
+        days_accrued = 0
+        offset = 0
+
+        while True:
+            page = await self._execute(
+                self.client.table("rentals")
+                .select("id, customer_id, rental_start_date, rental_end_date, rental_amount, billing_frequency")
+                .eq("organization_id", organization_id)
+                .eq("status", "active")
+                .order("id")
+                .range(offset, offset + PAGE_SIZE - 1)
+            )
+            rentals = page.data or []
+            if not rentals:
+                break
+
+            rentals_seen += len(rentals)
+            days_accrued += await self._accrue_rentals(organization_id, rentals, through)
+
+            if len(rentals) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+
+        return {
+            'organization_id': organization_id,
+            'through': through.isoformat(),
+            'rentals': rentals_seen,
+            'days_accrued': days_accrued
+        }
+
+    async def _accrue_rentals(
+        self,
+        organization_id: str,
+        rentals: List[Dict[str, Any]],
+        through: date
+    ) -> int:
+        cursors = await self._execute(
+            self.client.table("rental_accrual_cursors")
+            .select("rental_id, accrued_through")
+            .in_("rental_id", [r['id'] for r in rentals])
+        )
+        accrued_through = {
+            c['rental_id']: date.fromisoformat(c['accrued_through']) for c in (cursors.data or [])
+        }
+
+        rows = []
+        new_cursors = []
+        for rental in rentals:
+            first_day = date.fromisoformat(rental['rental_start_date'])
+            if rental['id'] in accrued_through:
+                first_day = max(first_day, accrued_through[rental['id']] + timedelta(days=1))
+
+            last_day = through
+            if rental.get('rental_end_date'):
+                last_day = min(last_day, date.fromisoformat(rental['rental_end_date']))
+
+            if first_day > last_day:
+                continue
+
+            rate = daily_rate(rental)
+            day = first_day
+            while day <= last_day:
+                rows.append({
+                    'rental_id': rental['id'],
+                    'organization_id': organization_id,
+                    'customer_id': rental.get('customer_id'),
+                    'accrual_date': day.isoformat(),
+                    'daily_rate': rate,
+                    'amount': rate
+                })
+                day += timedelta(days=1)
+
+            new_cursors.append({
+                'rental_id': rental['id'],
+                'organization_id': organization_id,
+                'accrued_through': last_day.isoformat()
+            })
+
+        # Upserts make a re-run after a partial failure harmless
+        for start in range(0, len(rows), PAGE_SIZE):
+            await self._execute(
+                self.client.table("rental_accruals").upsert(rows[start:start + PAGE_SIZE])
+            )
+        if new_cursors:
+            await self._execute(
+                self.client.table("rental_accrual_cursors").upsert(new_cursors)
+            )
+
+        return len(rows)
+
+    async def invoice_lines(
+        self,
+        organization_id: str,
+        customer_id: str,
+        period_start: date,
+        period_end: date
+    ) -> List[Dict[str, Any]]:
+        """
+        A customer's active rentals for the period with their bottle fields and
+        the days and amount accrued within it, in one round trip
+        """
+        response = await self._execute(
+            self.client.rpc("rental_invoice_lines", {
+                'p_organization_id': organization_id,
+                'p_customer_id': customer_id,
+                'p_period_start': period_start.isoformat(),
+                'p_period_end': period_end.isoformat()
+            })
+        )
+        return response.data or []
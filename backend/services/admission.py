@@ -0,0 +1,269 @@
+"""
+Admission control for PDF rendering and SMTP sends, fair across organizations
+"""
+import asyncio
+import time
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Deque, Tuple
+from ..config import settings
+from .errors import ServiceUnavailable
+from .log import organization_id_var
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Waiters are served in this order, so previews never queue behind batch work
+PRIORITIES = (INTERACTIVE, BATCH)
+
+# Work that can't be attributed to an organization shares one queue
+UNKNOWN_TENANT = "-"
+
+
+class AdmissionRejected(ServiceUnavailable):
+    """Raised when a render cannot be admitted (queue full or wait deadline passed)"""
+
+
+class AdmissionController:
+    """
+    Bounded concurrency with a bounded wait queue. Within each priority class,
+    waiters are grouped per organization and served weighted round-robin: a
+    tenant with weight w gets up to w slots in a row before the next tenant's
+    turn, so a tenant with thousands of queued jobs delays another tenant's
+    request by at most one round. A tenant may queue at most `tenant_max_queue`
+    waiters. `tenant_max_concurrent` only applies while other tenants are
+    waiting: free slots never sit idle, so a lone tenant can use them all.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_queue: int,
+        queue_timeout: float,
+        retry_after: int,
+        tenant_max_concurrent: Optional[int] = None,
+        tenant_max_queue: Optional[int] = None,
+        tenant_weights: Optional[Dict[str, int]] = None,
+        name: str = "render"
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.tenant_max_concurrent = min(tenant_max_concurrent or max_concurrent, max_concurrent)
+        self.tenant_max_queue = min(tenant_max_queue or max_queue, max_queue)
+        self.tenant_weights = tenant_weights or {}
+        self.name = name
+
+        self._active = 0
+        # priority -> tenant -> waiters; dict order is the round-robin rotation
+        self._waiters: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            p: OrderedDict() for p in PRIORITIES
+        }
+        # Slots left in the current turn of the tenant at the head of the rotation
+        self._turn: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._tenant_active: Dict[str, int] = {}
+        self._stats = {
+            p: {'admitted': 0, 'rejected': 0, 'timed_out': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+            for p in PRIORITIES
+        }
+        self._tenant_stats: Dict[str, Dict[str, Any]] = {}
+
+    def queue_depth(self) -> int:
+        return sum(len(q) for tenants in self._waiters.values() for q in tenants.values())
+
+    def tenant_queue_depth(self, tenant: str) -> int:
+        return sum(len(tenants.get(tenant, ())) for tenants in self._waiters.values())
+
+    def _weight(self, tenant: str) -> int:
+        return max(int(self.tenant_weights.get(tenant, 1)), 1)
+
+    def _count(self, priority: str, tenant: str, outcome: str, waited: Optional[float] = None):
+        for stats in (
+            self._stats[priority],
+            self._tenant_stats.setdefault(
+                tenant,
+                {'admitted': 0, 'rejected': 0, 'timed_out': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+            )
+        ):
+            stats[outcome] += 1
+            if waited is not None:
+                stats['wait_total'] += waited
+                stats['wait_max'] = max(stats['wait_max'], waited)
+
+    async def acquire(self, priority: str = BATCH, tenant: Optional[str] = None):
+        """Wait for a slot, or raise AdmissionRejected"""
+        if priority not in self._waiters:
+            raise ValueError(f"Unknown priority: {priority}")
+        tenant = tenant or organization_id_var.get() or UNKNOWN_TENANT
+
+        # Waiters are always handed free slots immediately, so a free slot here
+        # means nobody this tenant would overtake is waiting
+        if self._active < self.max_concurrent:
+            self._grant(tenant)
+            self._count(priority, tenant, 'admitted', 0.0)
+            return
+
+        if self.queue_depth() >= self.max_queue:
+            self._count(priority, tenant, 'rejected')
+            raise AdmissionRejected(f"{self.name.capitalize()} queue is full", self.retry_after)
+        if self.tenant_queue_depth(tenant) >= self.tenant_max_queue:
+            self._count(priority, tenant, 'rejected')
+            raise AdmissionRejected(f"Too many queued {self.name} jobs for this organization", self.retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._waiters[priority].setdefault(tenant, deque())
+        queue.append(waiter)
+        started = time.monotonic()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(priority, tenant, waiter)
+            self._count(priority, tenant, 'timed_out')
+            raise AdmissionRejected(f"Timed out waiting for a {self.name} slot", self.retry_after)
+        except asyncio.CancelledError:
+            self._abandon(priority, tenant, waiter)
+            raise
+
+        self._count(priority, tenant, 'admitted', time.monotonic() - started)
+
+    def _abandon(self, priority: str, tenant: str, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # Slot was handed over just as the wait ended; give it back
+            self.release(tenant)
+            return
+        waiter.cancel()
+        tenants = self._waiters[priority]
+        queue = tenants.get(tenant)
+        if queue is not None:
+            queue.remove(waiter)
+            if not queue:
+                self._drop_tenant(priority, tenant)
+
+    def _drop_tenant(self, priority: str, tenant: str):
+        tenants = self._waiters[priority]
+        if next(iter(tenants), None) == tenant:
+            self._turn[priority] = 0
+        del tenants[tenant]
+
+    def _grant(self, tenant: str):
+        self._active += 1
+        self._tenant_active[tenant] = self._tenant_active.get(tenant, 0) + 1
+
+    def release(self, tenant: Optional[str] = None):
+        """Free the tenant's slot and hand free slots to the next eligible waiters"""
+        tenant = tenant or organization_id_var.get() or UNKNOWN_TENANT
+        self._active -= 1
+        remaining = self._tenant_active.get(tenant, 0) - 1
+        if remaining > 0:
+            self._tenant_active[tenant] = remaining
+        else:
+            self._tenant_active.pop(tenant, None)
+
+        while self._active < self.max_concurrent:
+            next_waiter = self._next_waiter()
+            if next_waiter is None:
+                return
+            waiter, waiter_tenant = next_waiter
+            self._grant(waiter_tenant)
+            waiter.set_result(None)
+
+    def _next_waiter(self) -> Optional[Tuple[asyncio.Future, str]]:
+        """
+        Weighted round-robin over tenants, skipping tenants at their cap; if
+        only capped tenants are waiting, the slot goes to them anyway
+        """
+        for enforce_cap in (True, False):
+            for priority in PRIORITIES:
+                tenants = self._waiters[priority]
+                for _ in range(len(tenants)):
+                    tenant, queue = next(iter(tenants.items()))
+                    if enforce_cap and self._tenant_active.get(tenant, 0) >= self.tenant_max_concurrent:
+                        # Keeps its place in later rounds; its own release hands the slot back
+                        tenants.move_to_end(tenant)
+                        self._turn[priority] = 0
+                        continue
+
+                    if self._turn[priority] <= 0:
+                        self._turn[priority] = self._weight(tenant)
+                    self._turn[priority] -= 1
+                    waiter = queue.popleft()
+
+                    if not queue:
+                        self._drop_tenant(priority, tenant)
+                    elif self._turn[priority] <= 0:
+                        tenants.move_to_end(tenant)
+                    return waiter, tenant
+        return None
+
+    @asynccontextmanager
+    async def slot(self, priority: str = BATCH, tenant: Optional[str] = None):
+        tenant = tenant or organization_id_var.get() or UNKNOWN_TENANT
+        await self.acquire(priority, tenant)
+        try:
+            yield
+        finally:
+            self.release(tenant)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Current saturation, queue depth and wait times, per class and per organization"""
+        classes = {}
+        for priority in PRIORITIES:
+            stats = self._stats[priority]
+            admitted = stats['admitted']
+            classes[priority] = {
+                'queued': sum(len(q) for q in self._waiters[priority].values()),
+                'admitted': admitted,
+                'rejected': stats['rejected'],
+                'timed_out': stats['timed_out'],
+                'avg_wait_seconds': stats['wait_total'] / admitted if admitted else 0.0,
+                'max_wait_seconds': stats['wait_max']
+            }
+
+        tenants = {}
+        for tenant, stats in self._tenant_stats.items():
+            admitted = stats['admitted']
+            tenants[tenant] = {
+                'active': self._tenant_active.get(tenant, 0),
+                'queued': self.tenant_queue_depth(tenant),
+                'weight': self._weight(tenant),
+                'admitted': admitted,
+                'rejected': stats['rejected'],
+                'timed_out': stats['timed_out'],
+                'avg_wait_seconds': stats['wait_total'] / admitted if admitted else 0.0,
+                'max_wait_seconds': stats['wait_max']
+            }
+
+        return {
+            'active': self._active,
+            'max_concurrent': self.max_concurrent,
+            'queue_depth': self.queue_depth(),
+            'max_queue': self.max_queue,
+            'tenant_max_concurrent': self.tenant_max_concurrent,
+            'tenant_max_queue': self.tenant_max_queue,
+            'classes': classes,
+            'tenants': tenants
+        }
+
+
+render_admission = AdmissionController(
+    max_concurrent=settings.RENDER_MAX_CONCURRENCY,
+    max_queue=settings.RENDER_MAX_QUEUE,
+    queue_timeout=settings.RENDER_QUEUE_TIMEOUT_SECONDS,
+    retry_after=settings.RENDER_RETRY_AFTER_SECONDS,
+    tenant_max_concurrent=settings.RENDER_TENANT_MAX_CONCURRENCY,
+    tenant_max_queue=settings.RENDER_TENANT_MAX_QUEUE,
+    tenant_weights=settings.TENANT_WEIGHTS
+)
+
+# SMTP sends from the outbox; waiting is bounded by the claim batch, not rejected
+smtp_admission = AdmissionController(
+    max_concurrent=settings.OUTBOX_CONCURRENCY,
+    max_queue=settings.OUTBOX_BATCH_SIZE,
+    queue_timeout=settings.OUTBOX_LEASE_SECONDS,
+    retry_after=int(settings.OUTBOX_POLL_SECONDS),
+    tenant_max_concurrent=settings.OUTBOX_TENANT_MAX_CONCURRENCY,
+    tenant_weights=settings.TENANT_WEIGHTS,
+    name="email"
+)
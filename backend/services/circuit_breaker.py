@@ -0,0 +1,218 @@
+"""
+Circuit breakers for external dependencies (Supabase, Storage, SMTP)
+"""
+import asyncio
+import aiosmtplib
+import contextvars
+import functools
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Awaitable, Callable, Optional
+from ..config import settings
+from .errors import ServiceUnavailable
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(ServiceUnavailable):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+
+class DependencyTimeout(ServiceUnavailable):
+    """A dependency call exceeded its breaker's timeout"""
+
+
+# Errors that mean "the dependency is unhealthy" and must not be mistaken for "not found"
+DEPENDENCY_ERRORS = (CircuitOpenError, DependencyTimeout)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker. After `failure_threshold` failures the circuit
+    opens and calls fail immediately; after `reset_timeout` a limited number of
+    half-open probes decide whether it closes again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        call_timeout: float,
+        half_open_max_calls: int = 1,
+        is_failure: Optional[Callable[[BaseException], bool]] = None,
+        clock: Callable[[], float] = time.monotonic,
+        executor: Optional[ThreadPoolExecutor] = None
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure or (lambda e: True)
+        self.clock = clock
+        self.executor = executor
+
+        self.state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._stats = {
+            'calls': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'rejected': 0,
+            'opened': 0
+        }
+
+    def _before_call(self):
+        if self.state == OPEN:
+            remaining = self._opened_at + self.reset_timeout - self.clock()
+            if remaining > 0:
+                self._stats['rejected'] += 1
+                raise CircuitOpenError(
+                    f"{self.name} is unavailable (circuit open)",
+                    max(1, math.ceil(remaining))
+                )
+            self.state = HALF_OPEN
+            self._half_open_calls = 0
+
+        if self.state == HALF_OPEN:
+            if self._half_open_calls >= self.half_open_max_calls:
+                self._stats['rejected'] += 1
+                raise CircuitOpenError(
+                    f"{self.name} is unavailable (circuit half-open)",
+                    max(1, math.ceil(self.reset_timeout))
+                )
+            self._half_open_calls += 1
+
+    def _on_success(self):
+        self._consecutive_failures = 0
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+
+    def _on_failure(self):
+        self._stats['failures'] += 1
+        self._consecutive_failures += 1
+        if self.state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self._stats['opened'] += 1
+            self.state = OPEN
+            self._opened_at = self.clock()
+
+    async def call(
+        self,
+        fn: Callable[..., Awaitable[Any]],
+        *args,
+        **kwargs
+    ) -> Any:
+        """Await fn(*args, **kwargs) through the breaker with the call timeout"""
+        self._before_call()
+        self._stats['calls'] += 1
+        probe = self.state == HALF_OPEN
+
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), timeout=self.call_timeout)
+        except asyncio.TimeoutError:
+            self._stats['timeouts'] += 1
+            self._on_failure()
+            # Retry once the circuit may have closed again, or after another call's worth of time
+            retry_after = self.reset_timeout if self.state == OPEN else self.call_timeout
+            raise DependencyTimeout(
+                f"{self.name} did not respond within {self.call_timeout}s",
+                max(1, math.ceil(retry_after))
+            )
+        except Exception as e:
+            if self.is_failure(e):
+                self._on_failure()
+            else:
+                # The dependency answered (e.g. "not found"); it is healthy
+                self._on_success()
+            raise
+        except BaseException:
+            # Cancelled by the caller; give the probe slot back without a verdict
+            if probe and self.state == HALF_OPEN:
+                self._half_open_calls -= 1
+            raise
+
+        self._on_success()
+        return result
+
+    async def call_sync(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking call in a worker thread through the breaker"""
+        return await self.call(self.run_in_executor, fn, *args, **kwargs)
+
+    async def run_in_executor(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run a blocking call on this dependency's own thread pool (without the
+        breaker). A timed-out call keeps its thread until the client's own
+        timeout fires; with a dedicated pool that only ever starves calls to
+        the same dependency, never renders or the local SQLite stores.
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(context.run, fn, *args, **kwargs)
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self._consecutive_failures,
+            **self._stats
+        }
+
+
+def _is_server_failure(e: BaseException) -> bool:
+    """Responses from a live server (4xx, PostgREST/Storage API errors) don't trip the breaker"""
+    response = getattr(e, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code is not None:
+        return status_code >= 500
+    # postgrest APIError and storage3 StorageException carry the server's error payload
+    if type(e).__name__ in ('APIError', 'StorageException'):
+        return False
+    return True
+
+
+supabase_breaker = CircuitBreaker(
+    name="supabase",
+    failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.BREAKER_RESET_SECONDS,
+    call_timeout=settings.SUPABASE_TIMEOUT_SECONDS,
+    is_failure=_is_server_failure,
+    executor=ThreadPoolExecutor(max_workers=settings.SUPABASE_MAX_THREADS, thread_name_prefix="supabase")
+)
+
+storage_breaker = CircuitBreaker(
+    name="storage",
+    failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.BREAKER_RESET_SECONDS,
+    call_timeout=settings.STORAGE_TIMEOUT_SECONDS,
+    is_failure=_is_server_failure,
+    executor=ThreadPoolExecutor(max_workers=settings.STORAGE_MAX_THREADS, thread_name_prefix="storage")
+)
+
+
+def _is_smtp_failure(e: BaseException) -> bool:
+    """Permanent (5xx) rejections such as a bad recipient mean the relay itself is fine"""
+    if isinstance(e, aiosmtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(e, aiosmtplib.SMTPResponseException):
+        return not 500 <= e.code < 600
+    return True
+
+
+smtp_breaker = CircuitBreaker(
+    name="smtp",
+    failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.BREAKER_RESET_SECONDS,
+    call_timeout=settings.SMTP_TIMEOUT_SECONDS,
+    is_failure=_is_smtp_failure
+)
+
+
+def get_breaker_stats() -> Dict[str, Any]:
+    return {b.name: b.get_stats() for b in (supabase_breaker, storage_breaker, smtp_breaker)}
@@ -2,12 +2,17 @@
 Email Service for sending invoices
 """
 import aiosmtplib
+import logging
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 from typing import Optional, Dict, Any
 from ..config import settings
+from .log import get_logger, log_event
+from .circuit_breaker import smtp_breaker
+
+logger = get_logger("email")
 
 class EmailService:
     def __init__(self):
@@ -24,9 +29,10 @@ class EmailService:
         subject: str,
         body: str,
         pdf_path: Optional[str] = None,
-        invoice_number: Optional[str] = None
+        invoice_number: Optional[str] = None,
+        pdf_content: Optional[bytes] = None
     ):
-        """Send email with optional PDF attachment"""
+        """Send email with optional PDF attachment (from a file or in-memory bytes)"""
         if not self.smtp_host:
             raise Exception("SMTP not configured")
         
@@ -41,19 +47,23 @@ class EmailService:
             message.attach(MIMEText(body, 'html'))
             
             # Attach PDF if provided
-            if pdf_path:
+            if pdf_path and pdf_content is None:
                 with open(pdf_path, 'rb') as f:
-                    part = MIMEBase('application', 'pdf')
-                    part.set_payload(f.read())
-                    encoders.encode_base64(part)
-                    part.add_header(
-                        'Content-Disposition',
-                        f'attachment; filename="Invoice_{invoice_number or "invoice"}.pdf"'
-                    )
-                    message.attach(part)
+                    pdf_content = f.read()
+            
+            if pdf_content:
+                part = MIMEBase('application', 'pdf')
+                part.set_payload(pdf_content)
+                encoders.encode_base64(part)
+                part.add_header(
+                    'Content-Disposition',
+                    f'attachment; filename="Invoice_{invoice_number or "invoice"}.pdf"'
+                )
+                message.attach(part)
             
-            # Send email
-            await aiosmtplib.send(
+            # Send email (fails fast while the relay's breaker is open)
+            await smtp_breaker.call(
+                aiosmtplib.send,
                 message,
                 hostname=self.smtp_host,
                 port=self.smtp_port,
@@ -63,7 +73,7 @@ class EmailService:
             )
             
         except Exception as e:
-            print(f"Error sending email: {e}")
+            log_event(logger, "email.send_failed", logging.ERROR, exc_info=e, to=to_email, invoice_number=invoice_number)
             raise
     
     def get_default_email_body(
@@ -0,0 +1,12 @@
+"""
+Errors shared across services
+"""
+
+
+class ServiceUnavailable(Exception):
+    """Work was refused up front; the client should retry after `retry_after` seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
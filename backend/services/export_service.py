@@ -0,0 +1,150 @@
+"""
+Streaming export of invoices and line items with keyset pagination
+"""
+import base64
+import csv
+import io
+import json
+from datetime import date
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
+from supabase import Client
+from .circuit_breaker import supabase_breaker
+
+NDJSON = "ndjson"
+CSV = "csv"
+
+INVOICE_COLUMNS = [
+    'id', 'invoice_number', 'invoice_date', 'due_date', 'status',
+    'customer_id', 'customer_name', 'customer_email',
+    'invoice_period_start', 'invoice_period_end',
+    'subtotal', 'tax_amount', 'total_amount', 'currency'
+]
+
+LINE_ITEM_COLUMNS = [
+    'id', 'description', 'barcode', 'serial_number', 'rental_start_date',
+    'rental_days', 'quantity', 'unit_price', 'total_price'
+]
+
+
+class InvalidCursor(ValueError):
+    """The resume cursor could not be decoded"""
+
+
+# (invoice id, line items already written); None means the whole invoice was written
+Cursor = Tuple[str, Optional[int]]
+
+
+def encode_cursor(invoice_id: str, skip: Optional[int] = None) -> str:
+    position = {'after': invoice_id} if skip is None else {'at': invoice_id, 'skip': skip}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if 'after' in position:
+            return str(position['after']), None
+        return str(position['at']), int(position['skip'])
+    except Exception:
+        raise InvalidCursor("Invalid export cursor")
+
+
+class InvoiceExporter:
+    """
+    Walks rental_invoices in id order, `page_size` invoices (with their line
+    items embedded) per query, so memory stays bounded by one page. Every row
+    carries a cursor; passing the last one received resumes right after that
+    row. CSV rows inside an invoice point into it, so a stream cut between two
+    line items resumes with the next line item rather than the next invoice.
+    """
+
+    def __init__(self, client: Client, page_size: int):
+        self.client = client
+        self.page_size = page_size
+
+    async def fetch_page(
+        self,
+        organization_id: str,
+        start_date: date,
+        end_date: date,
+        cursor: Optional[Cursor] = None
+    ) -> List[Dict[str, Any]]:
+        query = (
+            self.client.table("rental_invoices")
+            .select("*, invoice_line_items(*)")
+            .eq("organization_id", organization_id)
+            .gte("invoice_date", start_date.isoformat())
+            .lte("invoice_date", end_date.isoformat())
+        )
+        if cursor:
+            invoice_id, skip = cursor
+            # A partly written invoice is fetched again; its written items are skipped
+            query = query.gt("id", invoice_id) if skip is None else query.gte("id", invoice_id)
+        response = await supabase_breaker.call_sync(
+            query.order("id").limit(self.page_size).execute
+        )
+        return response.data or []
+
+    async def stream(
+        self,
+        organization_id: str,
+        start_date: date,
+        end_date: date,
+        export_format: str,
+        cursor: Optional[Cursor] = None,
+        first_page: Optional[List[Dict[str, Any]]] = None
+    ) -> AsyncIterator[str]:
+        """Yield NDJSON lines or CSV rows page by page"""
+        resume_id, resume_skip = cursor if cursor else (None, None)
+        write_row = self._ndjson_rows if export_format == NDJSON else self._csv_rows
+        if export_format == CSV:
+            yield self._csv_line(
+                [f"invoice_{c}" for c in INVOICE_COLUMNS] + [f"line_{c}" for c in LINE_ITEM_COLUMNS] + ['cursor']
+            )
+
+        page = first_page
+        while True:
+            if page is None:
+                page = await self.fetch_page(organization_id, start_date, end_date, cursor)
+
+            for invoice in page:
+                skip = 0
+                if resume_skip is not None and str(invoice['id']) == resume_id:
+                    skip = resume_skip
+                for row in write_row(invoice, skip):
+                    yield row
+
+            if len(page) < self.page_size:
+                return
+            cursor = (page[-1]['id'], None)
+            resume_skip = None
+            page = None
+
+    def _ndjson_rows(self, invoice: Dict[str, Any], skip: int = 0):
+        # One line per invoice, so a resumed invoice is simply written whole
+        invoice = dict(invoice)
+        invoice['line_items'] = invoice.pop('invoice_line_items', None) or []
+        invoice['cursor'] = encode_cursor(invoice['id'])
+        yield json.dumps(invoice, default=str) + "\n"
+
+    def _csv_rows(self, invoice: Dict[str, Any], skip: int = 0):
+        invoice_values = [invoice.get(c) for c in INVOICE_COLUMNS]
+        # Stable order, so an in-invoice cursor means the same rows on resume
+        items = sorted(invoice.get('invoice_line_items') or [], key=lambda item: str(item.get('id')))
+        if not items:
+            # An invoice without items still gets a row
+            if skip == 0:
+                yield self._csv_line(
+                    invoice_values + [None] * len(LINE_ITEM_COLUMNS) + [encode_cursor(invoice['id'])]
+                )
+            return
+
+        for index in range(skip, len(items)):
+            written = index + 1
+            cursor = encode_cursor(invoice['id']) if written == len(items) else encode_cursor(invoice['id'], written)
+            yield self._csv_line(invoice_values + [items[index].get(c) for c in LINE_ITEM_COLUMNS] + [cursor])
+
+    def _csv_line(self, values: List[Any]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(['' if v is None else v for v in values])
+        return buffer.getvalue()
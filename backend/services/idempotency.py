@@ -0,0 +1,202 @@
+"""
+Idempotency key store backed by SQLite
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Optional, Dict, Any, Awaitable, Callable, Tuple
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from ..config import settings
+
+PENDING = "pending"
+COMPLETED = "completed"
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        db_path: str,
+        retention_seconds: int,
+        lock_timeout_seconds: int
+    ):
+        self.db_path = db_path
+        self.retention_seconds = retention_seconds
+        self.lock_timeout_seconds = lock_timeout_seconds
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    scope TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    status_code INTEGER,
+                    response TEXT,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (scope, key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys (created_at)")
+            self._initialized = True
+        return conn
+
+    def begin(
+        self,
+        scope: str,
+        key: str,
+        fingerprint: str
+    ) -> Optional[Tuple[int, Any]]:
+        """
+        Claim a key. Returns None if the caller should do the work,
+        or (status_code, body) of the stored outcome to replay.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < ?",
+                (now - self.retention_seconds,)
+            )
+            row = conn.execute(
+                "SELECT fingerprint, status, status_code, response, created_at FROM idempotency_keys WHERE scope = ? AND key = ?",
+                (scope, key)
+            ).fetchone()
+
+            if row is None:
+                conn.execute(
+                    "INSERT INTO idempotency_keys (scope, key, fingerprint, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (scope, key, fingerprint, PENDING, now)
+                )
+                conn.execute("COMMIT")
+                return None
+
+            stored_fingerprint, status, status_code, response, created_at = row
+
+            if stored_fingerprint != fingerprint:
+                conn.execute("COMMIT")
+                raise HTTPException(
+                    status_code=422,
+                    detail="Idempotency-Key was already used with a different request"
+                )
+
+            if status == COMPLETED:
+                conn.execute("COMMIT")
+                return status_code, json.loads(response)
+
+            if now - created_at < self.lock_timeout_seconds:
+                conn.execute("COMMIT")
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still in progress"
+                )
+
+            # The original attempt died without finishing; take it over
+            conn.execute(
+                "UPDATE idempotency_keys SET created_at = ? WHERE scope = ? AND key = ?",
+                (now, scope, key)
+            )
+            conn.execute("COMMIT")
+            return None
+
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def complete(
+        self,
+        scope: str,
+        key: str,
+        status_code: int,
+        body: Any
+    ):
+        """Record the outcome for replay"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE idempotency_keys SET status = ?, status_code = ?, response = ? WHERE scope = ? AND key = ?",
+                (COMPLETED, status_code, json.dumps(body), scope, key)
+            )
+        finally:
+            conn.close()
+
+    def release(
+        self,
+        scope: str,
+        key: str
+    ):
+        """Forget a pending key so the client can retry"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND status = ?",
+                (scope, key, PENDING)
+            )
+        finally:
+            conn.close()
+
+    async def run(
+        self,
+        scope: str,
+        key: Optional[str],
+        payload: Dict[str, Any],
+        fn: Callable[[], Awaitable[Any]],
+        status_code: int = 200
+    ) -> Any:
+        """
+        Run fn at most once per (scope, key) and replay its outcome afterwards.
+        Successes and client errors are stored; server errors release the key.
+        Services raise on infrastructure failures rather than returning "not
+        found", so a stored 4xx never records a transient outage.
+        """
+        if not key:
+            return await fn()
+
+        fingerprint = hashlib.sha256(
+            json.dumps(jsonable_encoder(payload), sort_keys=True).encode()
+        ).hexdigest()
+
+        stored = await asyncio.to_thread(self.begin, scope, key, fingerprint)
+        if stored is not None:
+            stored_status, body = stored
+            return JSONResponse(
+                status_code=stored_status,
+                content=body,
+                headers={"Idempotent-Replayed": "true"}
+            )
+
+        try:
+            result = await fn()
+        except HTTPException as e:
+            if e.status_code < 500:
+                await asyncio.to_thread(self.complete, scope, key, e.status_code, {"detail": e.detail})
+            else:
+                await asyncio.to_thread(self.release, scope, key)
+            raise
+        except BaseException:
+            await asyncio.to_thread(self.release, scope, key)
+            raise
+
+        await asyncio.to_thread(self.complete, scope, key, status_code, jsonable_encoder(result))
+        return result
+
+
+idempotency_store = IdempotencyStore(
+    db_path=os.path.join(settings.LOCAL_DATA_DIR, "idempotency.sqlite3"),
+    retention_seconds=settings.IDEMPOTENCY_RETENTION_HOURS * 3600,
+    lock_timeout_seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT_SECONDS
+)
@@ -0,0 +1,136 @@
+"""
+Typed invoice records, validated once where rows leave the data layer
+"""
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List
+
+
+def _str(value: Any) -> str:
+    return '' if value is None else str(value)
+
+
+def _float(value: Any) -> float:
+    return float(value) if value not in (None, '') else 0.0
+
+
+def _int(value: Any, default: int = 0) -> int:
+    return int(value) if value not in (None, '') else default
+
+
+@dataclass(slots=True)
+class LineItem:
+    description: str
+    barcode: str
+    serial_number: str
+    rental_start_date: str
+    rental_days: int
+    quantity: int
+    unit_price: float
+    total_price: float
+    cylinder_id: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "LineItem":
+        """Build from an invoice_line_items row, coercing the types once"""
+        return cls(
+            description=_str(row.get('description')),
+            barcode=_str(row.get('barcode')),
+            serial_number=_str(row.get('serial_number')),
+            rental_start_date=_str(row.get('rental_start_date')),
+            rental_days=_int(row.get('rental_days')),
+            quantity=_int(row.get('quantity'), 1),
+            unit_price=_float(row.get('unit_price')),
+            total_price=_float(row.get('total_price')),
+            cylinder_id=row.get('cylinder_id')
+        )
+
+    def to_row(self, invoice_id: str) -> Dict[str, Any]:
+        """invoice_line_items insert payload"""
+        return {
+            'invoice_id': invoice_id,
+            'line_type': 'rental',
+            'description': self.description,
+            'cylinder_id': self.cylinder_id,
+            'barcode': self.barcode,
+            'rental_start_date': self.rental_start_date or None,
+            'rental_days': self.rental_days,
+            'quantity': self.quantity,
+            'unit_price': self.unit_price,
+            'total_price': self.total_price
+        }
+
+
+@dataclass(slots=True)
+class InvoiceData:
+    customer_id: str
+    customer_name: str
+    customer_address: str
+    customer_email: str
+    invoice_number: str
+    invoice_date: str
+    invoice_period_start: str
+    invoice_period_end: str
+    line_items: List[LineItem]
+    subtotal: float
+    tax_amount: float
+    total_amount: float
+    tax_rate: float = 0.0
+    organization_name: str = ''
+    organization_address: str = ''
+    organization_phone: str = ''
+    organization_email: str = ''
+    organization_logo_url: str = ''
+    payment_terms: str = ''
+    invoice_notes: str = ''
+    notes: str = ''
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "InvoiceData":
+        """Build from a rental_invoices row with its invoice_line_items embedded"""
+        subtotal = _float(row.get('subtotal'))
+        tax_amount = _float(row.get('tax_amount'))
+        return cls(
+            customer_id=_str(row.get('customer_id')),
+            customer_name=_str(row.get('customer_name')),
+            customer_address=_str(row.get('customer_address')),
+            customer_email=_str(row.get('customer_email')),
+            invoice_number=_str(row.get('invoice_number')),
+            invoice_date=_str(row.get('invoice_date')),
+            invoice_period_start=_str(row.get('invoice_period_start')),
+            invoice_period_end=_str(row.get('invoice_period_end')),
+            line_items=[LineItem.from_row(item) for item in row.get('invoice_line_items') or []],
+            subtotal=subtotal,
+            tax_amount=tax_amount,
+            total_amount=_float(row.get('total_amount')),
+            tax_rate=tax_amount / subtotal if subtotal else 0.0,
+            notes=_str(row.get('notes'))
+        )
+
+    def to_record(
+        self,
+        organization_id: str,
+        template_id: Optional[str],
+        pdf_url: str,
+        user_id: str,
+        pdf_sha256: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """rental_invoices insert/update payload"""
+        return {
+            'organization_id': organization_id,
+            'invoice_number': self.invoice_number,
+            'customer_id': self.customer_id,
+            'customer_name': self.customer_name,
+            'customer_address': self.customer_address or None,
+            'customer_email': self.customer_email or None,
+            'invoice_date': self.invoice_date,
+            'invoice_period_start': self.invoice_period_start,
+            'invoice_period_end': self.invoice_period_end,
+            'subtotal': self.subtotal,
+            'tax_amount': self.tax_amount,
+            'total_amount': self.total_amount,
+            'pdf_url': pdf_url,
+            'pdf_sha256': pdf_sha256,
+            'template_id': template_id,
+            'status': 'draft',
+            'created_by': user_id
+        }
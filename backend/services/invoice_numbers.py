@@ -0,0 +1,132 @@
+"""
+Block-allocated invoice number reservation
+"""
+import asyncio
+import heapq
+from typing import Dict, Any, List, Tuple
+from supabase import Client
+from ..config import settings
+from .circuit_breaker import supabase_breaker, DEPENDENCY_ERRORS
+from .errors import ServiceUnavailable
+
+MAX_RESERVE_ATTEMPTS = 8
+RESERVE_RETRY_AFTER_SECONDS = 2
+
+
+class InvoiceNumbersUnavailable(ServiceUnavailable):
+    """Raised when the counter keeps moving under us; the request can simply be retried"""
+
+
+class InvoiceNumberAllocator:
+    """
+    Reserves blocks of numbers from invoice_settings.next_invoice_number with a
+    compare-and-swap update (the same protocol the web app uses), then hands
+    them out locally. A number released by a failed invoice is handed out
+    again first. Numbers left in a block when the process exits are skipped.
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        # organization_id -> (prefix, next number, end of block exclusive)
+        self._blocks: Dict[str, Tuple[str, int, int]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # organization_id -> released numbers (min-heap; numbers are zero-padded)
+        self._released: Dict[str, List[str]] = {}
+        self._reservations = 0
+        self._issued = 0
+
+    async def next_number(
+        self,
+        client: Client,
+        organization_id: str
+    ) -> str:
+        """Take the next reserved invoice number for an organization"""
+        lock = self._locks.setdefault(organization_id, asyncio.Lock())
+        async with lock:
+            released = self._released.get(organization_id)
+            if released:
+                self._issued += 1
+                return heapq.heappop(released)
+            
+            prefix, next_number, end = self._blocks.get(organization_id, ('', 0, 0))
+            if next_number >= end:
+                prefix, next_number, end = await self._reserve_block(client, organization_id, self.block_size)
+
+            self._blocks[organization_id] = (prefix, next_number + 1, end)
+            self._issued += 1
+            return self.format_number(prefix, next_number)
+
+    def release(self, organization_id: str, invoice_number: str):
+        """Give back a number whose invoice was never saved, so the sequence has no gap"""
+        heapq.heappush(self._released.setdefault(organization_id, []), invoice_number)
+        self._issued -= 1
+
+    def format_number(self, prefix: str, number: int) -> str:
+        return f"{prefix}{str(number).zfill(6)}"
+
+    async def _reserve_block(
+        self,
+        client: Client,
+        organization_id: str,
+        count: int
+    ) -> Tuple[str, int, int]:
+        """Atomically advance next_invoice_number by `count`; returns (prefix, start, end)"""
+        for _ in range(MAX_RESERVE_ATTEMPTS):
+            current = await supabase_breaker.call_sync(
+                client.table("invoice_settings")
+                .select("invoice_prefix, next_invoice_number")
+                .eq("organization_id", organization_id)
+                .limit(1)
+                .execute
+            )
+
+            if not current.data:
+                # No settings yet: create them with the table defaults and retry
+                try:
+                    await supabase_breaker.call_sync(
+                        client.table("invoice_settings").insert({'organization_id': organization_id}).execute
+                    )
+                except DEPENDENCY_ERRORS:
+                    raise
+                except Exception:
+                    # Someone else created them first
+                    pass
+                continue
+
+            row = current.data[0]
+            stored = row.get('next_invoice_number')
+            start = 1 if stored is None else stored
+
+            query = (
+                client.table("invoice_settings")
+                .update({'next_invoice_number': start + count})
+                .eq("organization_id", organization_id)
+            )
+            # Only succeeds if nobody advanced the counter since we read it
+            query = query.is_("next_invoice_number", "null") if stored is None else query.eq("next_invoice_number", stored)
+            updated = await supabase_breaker.call_sync(query.execute)
+
+            if updated.data:
+                self._reservations += 1
+                prefix = updated.data[0].get('invoice_prefix') or row.get('invoice_prefix') or 'INV'
+                return prefix, start, start + count
+
+            # Another worker or the web app reserved first; retry with fresh settings
+
+        raise InvoiceNumbersUnavailable(
+            "Failed to reserve invoice numbers due to concurrent updates", RESERVE_RETRY_AFTER_SECONDS
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'block_size': self.block_size,
+            'reservations': self._reservations,
+            'issued': self._issued,
+            'released': sum(len(numbers) for numbers in self._released.values()),
+            'organizations': len(self._blocks)
+        }
+
+
+invoice_number_allocator = InvoiceNumberAllocator(
+    block_size=settings.INVOICE_NUMBER_BLOCK_SIZE
+)
@@ -0,0 +1,214 @@
+"""
+Invoice generate and send pipeline shared by the routers and the scheduler
+"""
+from fastapi import HTTPException
+from datetime import date
+from typing import Optional, Dict, Any
+import asyncio
+import uuid
+import aiofiles
+
+from .supabase_service import SupabaseService
+from .pdf_service import PDFService
+from .email_service import EmailService
+from .admission import BATCH
+from .pdf_cache import pdf_cache, hash_file
+from .invoice_numbers import invoice_number_allocator
+from .outbox import email_outbox, outbox_dispatcher
+from .log import get_logger, bind, stage
+
+logger = get_logger("pipeline")
+
+
+class InvoicePipeline:
+    def __init__(self):
+        self.supabase_service = SupabaseService()
+        self.pdf_service = PDFService()
+        self.email_service = EmailService()
+
+    async def generate_invoice(
+        self,
+        organization_id: str,
+        customer_id: str,
+        period_start: date,
+        period_end: date,
+        template_id: Optional[str],
+        user_id: str,
+        priority: str = BATCH
+    ) -> Dict[str, Any]:
+        """Fetch, render, upload and save an invoice"""
+        bind(organization_id=organization_id)
+
+        # Fetch invoice data
+        with stage(logger, "invoice.fetch", customer_id=customer_id):
+            invoice_data = await self.supabase_service.get_invoice_data(
+                organization_id=organization_id,
+                customer_id=customer_id,
+                period_start=period_start,
+                period_end=period_end
+            )
+
+        if not invoice_data:
+            raise HTTPException(status_code=404, detail="No invoice data found")
+
+        # Fetch template
+        template = await self.supabase_service.get_template(
+            organization_id=organization_id,
+            template_id=template_id
+        )
+
+        if not template:
+            raise HTTPException(status_code=404, detail="Template not found")
+
+        # Reserve the number only once the invoice can be built; it is printed
+        # on the PDF, so it has to come before the render
+        invoice_number = await invoice_number_allocator.next_number(
+            self.supabase_service.client, organization_id
+        )
+        invoice_data.invoice_number = invoice_number
+
+        try:
+            # Generate PDF
+            with stage(logger, "invoice.render", invoice_number=invoice_number, priority=priority):
+                pdf_path = await self.pdf_service.generate_pdf(
+                    invoice_data=invoice_data,
+                    template=template,
+                    organization_id=organization_id,
+                    priority=priority
+                )
+
+            # Stored with the invoice so cached copies elsewhere can tell they are stale
+            pdf_sha256 = await asyncio.to_thread(hash_file, pdf_path)
+
+            # Upload to Supabase Storage
+            with stage(logger, "invoice.upload", invoice_number=invoice_number):
+                pdf_url = await self.supabase_service.upload_pdf(
+                    file_path=pdf_path,
+                    organization_id=organization_id,
+                    invoice_number=invoice_number or f"INV-{uuid.uuid4().hex[:8]}"
+                )
+        except BaseException:
+            # Nothing references the number yet; the next invoice takes it. A failed
+            # save keeps it, since the row may have been written before the error
+            invoice_number_allocator.release(organization_id, invoice_number)
+            raise
+
+        # Create or update invoice record
+        with stage(logger, "invoice.save", invoice_number=invoice_number):
+            invoice_id = await self.supabase_service.save_invoice(
+                organization_id=organization_id,
+                invoice_data=invoice_data,
+                template_id=template_id,
+                pdf_url=pdf_url,
+                user_id=user_id,
+                pdf_sha256=pdf_sha256
+            )
+
+        # Keep the rendered bytes locally so sends and reminders skip the download
+        if invoice_id:
+            await asyncio.to_thread(pdf_cache.put, invoice_id, pdf_path, pdf_sha256)
+
+        return {
+            'pdf_url': pdf_url,
+            'invoice_id': invoice_id,
+            'invoice_number': invoice_data.invoice_number,
+            'total_amount': invoice_data.total_amount,
+            'customer_email': invoice_data.customer_email
+        }
+
+    async def find_invoice(
+        self,
+        organization_id: str,
+        customer_id: str,
+        period_start: date,
+        period_end: date
+    ) -> Optional[str]:
+        """Id of an invoice already saved for the customer and period, if any"""
+        return await self.supabase_service.find_invoice(
+            organization_id=organization_id,
+            customer_id=customer_id,
+            period_start=period_start,
+            period_end=period_end
+        )
+
+    async def queue_invoice_email(
+        self,
+        organization_id: str,
+        invoice_id: str,
+        template_id: Optional[str] = None,
+        to_email: Optional[str] = None,
+        subject: Optional[str] = None,
+        message: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Render or fetch the invoice PDF and queue the email in the outbox.
+        The dispatcher delivers it and marks the invoice sent once SMTP accepts it.
+        """
+        bind(organization_id=organization_id)
+
+        # Get invoice data
+        invoice = await self.supabase_service.get_invoice_by_id(
+            invoice_id=invoice_id,
+            organization_id=organization_id
+        )
+
+        if not invoice:
+            raise HTTPException(status_code=404, detail="Invoice not found")
+
+        # Get template
+        template = await self.supabase_service.get_template(
+            organization_id=organization_id,
+            template_id=template_id or invoice.get('template_id')
+        )
+
+        if not template:
+            raise HTTPException(status_code=404, detail="Template not found")
+
+        # Generate PDF if not exists
+        if invoice.get('pdf_url'):
+            # Use the locally cached PDF, downloading it only on a miss
+            pdf_content = await self.supabase_service.download_pdf(
+                invoice['pdf_url'],
+                invoice_id=invoice_id,
+                content_hash=invoice.get('pdf_sha256')
+            )
+        else:
+            # Generate new PDF
+            invoice_data = await self.supabase_service.get_invoice_data_from_id(
+                invoice_id=invoice_id,
+                organization_id=organization_id
+            )
+            if not invoice_data:
+                raise HTTPException(status_code=404, detail="Invoice not found")
+            pdf_path = await self.pdf_service.generate_pdf(
+                invoice_data=invoice_data,
+                template=template,
+                organization_id=organization_id
+            )
+            async with aiofiles.open(pdf_path, 'rb') as f:
+                pdf_content = await f.read()
+
+        # Get customer email
+        customer_email = to_email or invoice.get('customer_email')
+        if not customer_email:
+            raise HTTPException(status_code=400, detail="Customer email not found")
+
+        # Prepare email content
+        subject = subject or f"Invoice {invoice.get('invoice_number', '')}"
+        message = message or self.email_service.get_default_email_body(invoice, template)
+
+        # Queue email (the attachment is stored with it so retries don't re-render)
+        with stage(logger, "email.enqueue", invoice_id=invoice_id):
+            outbox_id = await asyncio.to_thread(
+                email_outbox.enqueue,
+                organization_id=organization_id,
+                invoice_id=invoice_id,
+                invoice_number=invoice.get('invoice_number', ''),
+                to_email=customer_email,
+                subject=subject,
+                body=message,
+                pdf=pdf_content
+            )
+        outbox_dispatcher.wake()
+
+        return {"message": "Email queued for delivery", "to": customer_email, "outbox_id": outbox_id}
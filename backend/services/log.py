@@ -0,0 +1,157 @@
+"""
+Queue-backed structured (JSON lines) logging with request context
+"""
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, Dict, Any
+
+request_id_var: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+organization_id_var: ContextVar[Optional[str]] = ContextVar('organization_id', default=None)
+
+ROOT_LOGGER = "invoice_api"
+
+_success_sample_rate = 1.0
+_listener: Optional[QueueListener] = None
+_dropped = 0
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def bind(request_id: Optional[str] = None, organization_id: Optional[str] = None):
+    """Attach ids to every record logged from the current task"""
+    if request_id is not None:
+        request_id_var.set(request_id)
+    if organization_id is not None:
+        organization_id_var.set(organization_id)
+
+
+def sampled() -> bool:
+    """Whether a high-volume success event should be logged this time"""
+    return _success_sample_rate >= 1.0 or random.random() < _success_sample_rate
+
+
+def log_event(
+    logger: logging.Logger,
+    event: str,
+    level: int = logging.INFO,
+    exc_info: Any = None,
+    **fields
+):
+    logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+
+@contextmanager
+def stage(logger: logging.Logger, name: str, **fields):
+    """
+    Time a pipeline stage. Failures are always logged with their duration;
+    successes only for the sampled fraction (LOG_SUCCESS_SAMPLE_RATE).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        log_event(
+            logger, f"{name}.failed", logging.ERROR, exc_info=e,
+            stage=name, duration_ms=round((time.perf_counter() - started) * 1000, 1), **fields
+        )
+        raise
+    if sampled():
+        log_event(
+            logger, f"{name}.completed",
+            stage=name, duration_ms=round((time.perf_counter() - started) * 1000, 1),
+            sample_rate=_success_sample_rate, **fields
+        )
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    Captures the context ids on the calling task and hands the record to the
+    listener thread; formatting and the stdout write happen there. When the
+    queue is full records are dropped rather than blocking the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        record.organization_id = organization_id_var.get()
+        if record.exc_info:
+            # Tracebacks hold frames; render them now so the record is safe to pass on
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'organization_id': getattr(record, 'organization_id', None)
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_text:
+            entry['error'] = record.exc_text.strip().splitlines()[-1]
+            entry['traceback'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level: str, success_sample_rate: float, queue_size: int):
+    """Route the app's loggers through a bounded queue to a JSON stdout writer"""
+    global _listener, _success_sample_rate
+    if _listener is not None:
+        return
+
+    _success_sample_rate = success_sample_rate
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter())
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level.upper())
+    logger.addHandler(_ContextQueueHandler(log_queue))
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    logger = logging.getLogger(ROOT_LOGGER)
+    for handler in list(logger.handlers):
+        if isinstance(handler, _ContextQueueHandler):
+            logger.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_stats() -> Dict[str, Any]:
+    return {
+        'success_sample_rate': _success_sample_rate,
+        'queued': _listener.queue.qsize() if _listener else 0,
+        'dropped': _dropped
+    }
@@ -0,0 +1,460 @@
+"""
+Durable email outbox backed by SQLite, drained by a background dispatcher
+"""
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+from typing import Optional, Dict, Any, List
+from ..config import settings
+from .log import get_logger, log_event, bind, stage
+from .email_service import EmailService
+from .supabase_service import SupabaseService
+from .circuit_breaker import CircuitOpenError
+from .admission import smtp_admission, AdmissionRejected, BATCH
+
+logger = get_logger("outbox")
+
+# How often the dispatcher drops SENT and FAILED rows past retention
+PURGE_INTERVAL_SECONDS = 3600.0
+
+PENDING = "pending"
+SENDING = "sending"
+# SMTP accepted the message but the invoice status has not been updated yet
+DELIVERED = "delivered"
+SENT = "sent"
+FAILED = "failed"
+
+
+class EmailOutbox:
+    def __init__(
+        self,
+        db_path: str,
+        max_attempts: int,
+        backoff_base: float,
+        backoff_max: float,
+        lease_seconds: float,
+        status_max_attempts: int,
+        retention_seconds: float,
+        tenant_weights: Optional[Dict[str, int]] = None
+    ):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.status_max_attempts = status_max_attempts
+        self.retention_seconds = retention_seconds
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease_seconds = lease_seconds
+        self.tenant_weights = tenant_weights or {}
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS email_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    organization_id TEXT NOT NULL,
+                    invoice_id TEXT NOT NULL,
+                    invoice_number TEXT,
+                    to_email TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    pdf BLOB,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON email_outbox (status, next_attempt_at)")
+            # Failed invoice status updates, counted per invoice across all its messages
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS invoice_status_attempts (
+                    invoice_id TEXT PRIMARY KEY,
+                    attempts INTEGER NOT NULL
+                )
+            """)
+            self._initialized = True
+        return conn
+
+    def enqueue(
+        self,
+        organization_id: str,
+        invoice_id: str,
+        invoice_number: Optional[str],
+        to_email: str,
+        subject: str,
+        body: str,
+        pdf: Optional[bytes]
+    ) -> int:
+        """Persist a message for delivery, returns its outbox id"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                """
+                INSERT INTO email_outbox
+                    (organization_id, invoice_id, invoice_number, to_email, subject, body, pdf,
+                     status, next_attempt_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (organization_id, invoice_id, invoice_number, to_email, subject, body, pdf,
+                 PENDING, now, now, now)
+            )
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def claim_due(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Lease up to `limit` due messages. A leased message that is never
+        resolved (crash mid-send) becomes due again when the lease expires.
+        Organizations are interleaved by weight (oldest first within each), so
+        one organization's backlog can't fill every batch.
+        """
+        now = time.time()
+        weight_params: List[Any] = []
+        for organization_id, weight in self.tenant_weights.items():
+            weight_params += [organization_id, max(int(weight), 1)]
+        weight_sql = (
+            "CASE organization_id " + "WHEN ? THEN ? " * len(self.tenant_weights) + "ELSE 1 END"
+            if self.tenant_weights else "1"
+        )
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                f"""
+                SELECT * FROM (
+                    SELECT *, ROW_NUMBER() OVER (
+                        PARTITION BY organization_id ORDER BY next_attempt_at
+                    ) AS tenant_rank
+                    FROM email_outbox
+                    WHERE status IN (?, ?, ?) AND next_attempt_at <= ?
+                )
+                ORDER BY (tenant_rank - 1) / {weight_sql}, next_attempt_at
+                LIMIT ?
+                """,
+                (PENDING, SENDING, DELIVERED, now, *weight_params, limit)
+            ).fetchall()
+
+            claimed = []
+            for row in rows:
+                # A lapsed SENDING lease means the outcome is unknown; treat it as a failed attempt
+                status = PENDING if row['status'] == SENDING else row['status']
+                attempts = row['attempts'] + (1 if row['status'] == SENDING else 0)
+                if status == PENDING and attempts >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE email_outbox SET status = ?, attempts = ?, pdf = NULL, updated_at = ? WHERE id = ?",
+                        (FAILED, attempts, now, row['id'])
+                    )
+                    continue
+
+                next_status = SENDING if status == PENDING else DELIVERED
+                conn.execute(
+                    "UPDATE email_outbox SET status = ?, attempts = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                    (next_status, attempts, now + self.lease_seconds, now, row['id'])
+                )
+                message = dict(row)
+                del message['tenant_rank']
+                message['status'] = status
+                message['attempts'] = attempts
+                claimed.append(message)
+
+            conn.execute("COMMIT")
+            return claimed
+
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def mark_delivered(self, message_id: int):
+        """SMTP accepted the message; never send it again"""
+        self._update(message_id, status=DELIVERED, next_attempt_at=time.time() + self.lease_seconds)
+
+    def mark_sent(self, message_id: int, invoice_id: str):
+        """Delivered and the invoice is marked sent; drop the attachment"""
+        self._update(message_id, status=SENT, pdf=None, last_error=None)
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM invoice_status_attempts WHERE invoice_id = ?", (invoice_id,))
+        finally:
+            conn.close()
+
+    def mark_retry(self, message_id: int, attempts: int, error: str):
+        """Schedule another send attempt with exponential backoff, or give up"""
+        attempts += 1
+        if attempts >= self.max_attempts:
+            self._update(message_id, status=FAILED, attempts=attempts, pdf=None, last_error=error)
+            return
+
+        self._update(
+            message_id,
+            status=PENDING,
+            attempts=attempts,
+            next_attempt_at=time.time() + self._backoff(attempts),
+            last_error=error
+        )
+
+    def mark_status_retry(self, message_id: int, invoice_id: str, error: str) -> bool:
+        """
+        Count a failed invoice status update against the invoice, so resends of
+        the same invoice share one budget. Schedules another try with backoff,
+        or marks the message FAILED; returns False when it gave up.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """
+                INSERT INTO invoice_status_attempts (invoice_id, attempts) VALUES (?, 1)
+                ON CONFLICT (invoice_id) DO UPDATE SET attempts = attempts + 1
+                """,
+                (invoice_id,)
+            )
+            attempts = conn.execute(
+                "SELECT attempts FROM invoice_status_attempts WHERE invoice_id = ?",
+                (invoice_id,)
+            ).fetchone()['attempts']
+
+            now = time.time()
+            if attempts >= self.status_max_attempts:
+                conn.execute(
+                    "UPDATE email_outbox SET status = ?, pdf = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                    (FAILED, f"Delivered, but the invoice status update failed: {error}", now, message_id)
+                )
+            else:
+                conn.execute(
+                    "UPDATE email_outbox SET status = ?, next_attempt_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                    (DELIVERED, now + self._backoff(attempts), error, now, message_id)
+                )
+            conn.execute("COMMIT")
+            return attempts < self.status_max_attempts
+
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** max(attempts - 1, 0)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def purge(self) -> int:
+        """
+        Delete SENT and FAILED rows older than the retention period, returns how
+        many. Terminal rows already dropped their attachment when they finished.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            purged = conn.execute(
+                "DELETE FROM email_outbox WHERE status IN (?, ?) AND updated_at < ?",
+                (SENT, FAILED, time.time() - self.retention_seconds)
+            ).rowcount
+            conn.execute(
+                """
+                DELETE FROM invoice_status_attempts WHERE NOT EXISTS (
+                    SELECT 1 FROM email_outbox o WHERE o.invoice_id = invoice_status_attempts.invoice_id
+                )
+                """
+            )
+            conn.execute("COMMIT")
+            return purged
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def defer(self, message_id: int, status: str, delay: float):
+        """Reschedule without counting an attempt"""
+        self._update(message_id, status=status, next_attempt_at=time.time() + delay)
+
+    def _update(self, message_id: int, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        try:
+            conn.execute(
+                f"UPDATE email_outbox SET {assignments} WHERE id = ?",
+                (*fields.values(), message_id)
+            )
+        finally:
+            conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        try:
+            counts = {
+                row['status']: row['count']
+                for row in conn.execute("SELECT status, COUNT(*) AS count FROM email_outbox GROUP BY status")
+            }
+            oldest = conn.execute(
+                "SELECT MIN(created_at) AS oldest FROM email_outbox WHERE status IN (?, ?)",
+                (PENDING, SENDING)
+            ).fetchone()['oldest']
+            organizations = conn.execute(
+                """
+                SELECT organization_id, COUNT(*) AS count, MIN(created_at) AS oldest
+                FROM email_outbox WHERE status IN (?, ?)
+                GROUP BY organization_id
+                """,
+                (PENDING, SENDING)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        now = time.time()
+        return {
+            'counts': counts,
+            'oldest_pending_age_seconds': now - oldest if oldest else 0.0,
+            'pending_by_organization': {
+                row['organization_id']: {
+                    'pending': row['count'],
+                    'oldest_pending_age_seconds': now - row['oldest']
+                }
+                for row in organizations
+            }
+        }
+
+
+class OutboxDispatcher:
+    def __init__(
+        self,
+        outbox: EmailOutbox,
+        poll_interval: float,
+        batch_size: int
+    ):
+        self.outbox = outbox
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Drain now instead of waiting for the next poll"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.drain()
+            except Exception as e:
+                log_event(logger, "outbox.drain_failed", logging.ERROR, exc_info=e)
+
+            if time.monotonic() - self._last_purge >= PURGE_INTERVAL_SECONDS:
+                self._last_purge = time.monotonic()
+                try:
+                    purged = await asyncio.to_thread(self.outbox.purge)
+                    if purged:
+                        log_event(logger, "outbox.purged", logging.INFO, rows=purged)
+                except Exception as e:
+                    log_event(logger, "outbox.purge_failed", logging.ERROR, exc_info=e)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def drain(self):
+        """Deliver every message that is currently due"""
+        while True:
+            messages = await asyncio.to_thread(self.outbox.claim_due, self.batch_size)
+            if not messages:
+                return
+            # SMTP concurrency and per-organization fairness come from smtp_admission
+            await asyncio.gather(*(self._deliver(m) for m in messages))
+
+    async def _deliver(self, message: Dict[str, Any]):
+        # Each message is delivered in its own task, so this context is per message
+        bind(request_id=f"outbox-{message['id']}", organization_id=message['organization_id'])
+        delivered = message['status'] == DELIVERED
+
+        if not delivered:
+            try:
+                async with smtp_admission.slot(BATCH, message['organization_id']):
+                    with stage(logger, "email.send", invoice_id=message['invoice_id'], attempt=message['attempts'] + 1):
+                        await EmailService().send_email(
+                            to_email=message['to_email'],
+                            subject=message['subject'],
+                            body=message['body'],
+                            pdf_content=message['pdf'],
+                            invoice_number=message['invoice_number']
+                        )
+            except (CircuitOpenError, AdmissionRejected) as e:
+                # The relay is known to be down or busy; wait without spending an attempt
+                await asyncio.to_thread(self.outbox.defer, message['id'], PENDING, e.retry_after)
+                return
+            except Exception as e:
+                await asyncio.to_thread(self.outbox.mark_retry, message['id'], message['attempts'], str(e))
+                return
+            await asyncio.to_thread(self.outbox.mark_delivered, message['id'])
+
+        # Only confirmed delivery flips the invoice to sent
+        try:
+            await SupabaseService().update_invoice_status(
+                invoice_id=message['invoice_id'],
+                status='sent'
+            )
+        except Exception as e:
+            retrying = await asyncio.to_thread(
+                self.outbox.mark_status_retry, message['id'], message['invoice_id'], str(e)
+            )
+            if not retrying:
+                # The customer has the email but the invoice still isn't marked sent
+                log_event(
+                    logger, "outbox.status_update_abandoned", logging.ERROR, exc_info=e,
+                    invoice_id=message['invoice_id'], message_id=message['id']
+                )
+            return
+        await asyncio.to_thread(self.outbox.mark_sent, message['id'], message['invoice_id'])
+
+
+email_outbox = EmailOutbox(
+    db_path=os.path.join(settings.LOCAL_DATA_DIR, "outbox.sqlite3"),
+    max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+    backoff_base=settings.OUTBOX_BACKOFF_BASE_SECONDS,
+    backoff_max=settings.OUTBOX_BACKOFF_MAX_SECONDS,
+    lease_seconds=settings.OUTBOX_LEASE_SECONDS,
+    status_max_attempts=settings.OUTBOX_STATUS_MAX_ATTEMPTS,
+    retention_seconds=settings.OUTBOX_RETENTION_DAYS * 86400,
+    tenant_weights=settings.TENANT_WEIGHTS
+)
+
+outbox_dispatcher = OutboxDispatcher(
+    outbox=email_outbox,
+    poll_interval=settings.OUTBOX_POLL_SECONDS,
+    batch_size=settings.OUTBOX_BATCH_SIZE
+)
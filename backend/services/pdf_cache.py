@@ -0,0 +1,242 @@
+"""
+Local cache of generated invoice PDFs
+"""
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, List
+import httpx
+from ..config import settings
+from .shared_cache import TOUCH_INTERVAL_SECONDS
+
+CHUNK_SIZE = 64 * 1024
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared keep-alive client for fetching stored PDFs"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20)
+        )
+    return _http_client
+
+
+def hash_file(path: str) -> str:
+    """sha256 of a file, the version stored with an invoice's PDF"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+class PDFCache:
+    """
+    Size-bounded LRU of invoice PDFs on local disk, shared by every worker on
+    the host. Files are named {invoice_id}.{sha256}.pdf; the index (LRU order
+    and total size) lives in SQLite so eviction stays correct across processes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.db_path = os.path.join(cache_dir, "index.sqlite3")
+        self._local = threading.local()
+        self._initialized = False
+        self._hits = 0
+        self._misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        if not self._initialized:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pdf_cache (
+                    invoice_id TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pdf_cache_lru ON pdf_cache (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS pdf_cache_size (id INTEGER PRIMARY KEY CHECK (id = 1), bytes INTEGER NOT NULL)")
+            stale = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                if conn.execute("INSERT OR IGNORE INTO pdf_cache_size (id, bytes) VALUES (1, 0)").rowcount:
+                    stale = self._adopt_files(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            for stale_path in stale:
+                self._remove_file(stale_path)
+            self._initialized = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._local.conn = conn
+        return conn
+
+    def _adopt_files(self, conn: sqlite3.Connection) -> List[str]:
+        """
+        Index PDFs already on disk (new index), oldest first so the newest file
+        wins for an invoice, then evict down to size. Returns the files to remove.
+        """
+        found = []
+        for name in os.listdir(self.cache_dir):
+            parts = name.split('.')
+            if len(parts) != 3 or parts[2] != 'pdf':
+                continue
+            path = os.path.join(self.cache_dir, name)
+            found.append((os.stat(path), parts[0], parts[1], path))
+
+        stale = []
+        for stat, invoice_id, content_hash, path in sorted(found, key=lambda f: f[0].st_mtime):
+            stale += self._record(conn, invoice_id, content_hash, path, stat.st_size, stat.st_mtime)
+        return stale + self._evict(conn)
+
+    def get(
+        self,
+        invoice_id: str,
+        content_hash: Optional[str] = None
+    ) -> Optional[bytes]:
+        """
+        Contents of the cached PDF for an invoice, or None. Bytes rather than a
+        path: another worker's eviction may delete the file at any moment.
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT content_hash, path, accessed_at FROM pdf_cache WHERE invoice_id = ?",
+            (invoice_id,)
+        ).fetchone()
+        if row is None or (content_hash and row[0] != content_hash):
+            self._misses += 1
+            return None
+        try:
+            with open(row[1], 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            self._misses += 1
+            return None
+
+        now = time.time()
+        if now - row[2] > TOUCH_INTERVAL_SECONDS:
+            conn.execute("UPDATE pdf_cache SET accessed_at = ? WHERE invoice_id = ?", (now, invoice_id))
+        self._hits += 1
+        return content
+
+    def put(
+        self,
+        invoice_id: str,
+        source_path: str,
+        content_hash: Optional[str] = None
+    ) -> str:
+        """Move a rendered or downloaded PDF into the cache, returns its cached path"""
+        content_hash = content_hash or hash_file(source_path)
+        path = os.path.join(self.cache_dir, f"{invoice_id}.{content_hash}.pdf")
+
+        conn = self._connect()
+        shutil.move(source_path, path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            stale = self._record(conn, invoice_id, content_hash, path, os.path.getsize(path), time.time())
+            stale += self._evict(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+        # Files are removed only after the index stops pointing at them
+        for stale_path in stale:
+            self._remove_file(stale_path)
+
+        return path
+
+    def _record(
+        self,
+        conn: sqlite3.Connection,
+        invoice_id: str,
+        content_hash: str,
+        path: str,
+        size: int,
+        accessed_at: float
+    ) -> List[str]:
+        """Upsert an entry, returns the replaced file if it differs"""
+        previous = conn.execute(
+            "SELECT path, size FROM pdf_cache WHERE invoice_id = ?",
+            (invoice_id,)
+        ).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO pdf_cache (invoice_id, content_hash, path, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (invoice_id, content_hash, path, size, accessed_at)
+        )
+        conn.execute(
+            "UPDATE pdf_cache_size SET bytes = bytes + ? WHERE id = 1",
+            (size - (previous[1] if previous else 0),)
+        )
+        return [previous[0]] if previous and previous[0] != path else []
+
+    def _evict(self, conn: sqlite3.Connection) -> List[str]:
+        """Drop least recently used entries (always keeping one), returns their files"""
+        total = conn.execute("SELECT bytes FROM pdf_cache_size WHERE id = 1").fetchone()[0]
+        removed = []
+        while total > self.max_bytes:
+            victims = conn.execute(
+                "SELECT invoice_id, path, size FROM pdf_cache ORDER BY accessed_at LIMIT 2"
+            ).fetchall()
+            if len(victims) < 2:
+                break
+            invoice_id, path, size = victims[0]
+            conn.execute("DELETE FROM pdf_cache WHERE invoice_id = ?", (invoice_id,))
+            total -= size
+            removed.append(path)
+        conn.execute("UPDATE pdf_cache_size SET bytes = ? WHERE id = 1", (total,))
+        return removed
+
+    def _remove_file(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        entries = conn.execute("SELECT COUNT(*) FROM pdf_cache").fetchone()[0]
+        lookups = self._hits + self._misses
+        return {
+            'entries': entries,
+            'bytes': conn.execute("SELECT bytes FROM pdf_cache_size WHERE id = 1").fetchone()[0],
+            'max_bytes': self.max_bytes,
+            # Hits and misses are this worker's; entries and bytes are host-wide
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': self._hits / lookups if lookups else 0.0
+        }
+
+
+pdf_cache = PDFCache(
+    cache_dir=os.path.join(settings.LOCAL_DATA_DIR, "pdf_cache"),
+    max_bytes=settings.PDF_CACHE_MAX_MB * 1024 * 1024
+)
@@ -3,67 +3,290 @@ PDF Generation Service using WeasyPrint and Jinja2
 """
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 from weasyprint import HTML, CSS
-from typing import Dict, Any, Optional
+from PIL import Image
+import pypdfium2 as pdfium
+from typing import Dict, Any, Optional, Tuple
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import logging
 import os
 import tempfile
 from datetime import datetime
 from ..config import settings
+from .log import get_logger, log_event
+from .admission import render_admission, BATCH, INTERACTIVE
+from .invoice_models import InvoiceData, LineItem
+from .shared_cache import shared_cache, SharedBytecodeCache, PREVIEWS, ASSETS
+from .pdf_cache import get_http_client
+
+logger = get_logger("pdf")
+
+STANDARD = "standard"
+COMPACT = "compact"
+
+_output_stats = {'renders': 0, 'bytes_total': 0, 'last_bytes': 0}
+
+# Shared so each template is compiled once per process, not once per request;
+# the bytecode cache lets a new worker skip compilation entirely
+_jinja_env = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), '..', 'templates')),
+    autoescape=select_autoescape(['html', 'xml']),
+    bytecode_cache=SharedBytecodeCache(shared_cache)
+)
 
 class PDFService:
     def __init__(self):
-        template_dir = os.path.join(os.path.dirname(__file__), '..', 'templates')
-        self.env = Environment(
-            loader=FileSystemLoader(template_dir),
-            autoescape=select_autoescape(['html', 'xml'])
-        )
+        self.last_output_bytes = 0
+        self.env = _jinja_env
     
     async def generate_pdf(
         self,
-        invoice_data: Dict[str, Any],
+        invoice_data: InvoiceData,
         template: Dict[str, Any],
-        organization_id: str
+        organization_id: str,
+        priority: str = BATCH,
+        profile: Optional[str] = None
     ) -> str:
         """Generate PDF from invoice data and template"""
+        profile = profile or settings.PDF_OUTPUT_PROFILE
+        
+        logo_url = template.get('layout_json', {}).get('logo_url')
+        if profile == COMPACT and logo_url:
+            logo_url = await self._compact_logo(logo_url)
+        
+        async with render_admission.slot(priority, organization_id):
+            return await self._render_pdf(invoice_data, template, profile, logo_url)
+    
+    async def _render_pdf(
+        self,
+        invoice_data: InvoiceData,
+        template: Dict[str, Any],
+        profile: str = STANDARD,
+        logo_url: Optional[str] = None
+    ) -> str:
+        """Render the PDF to a temp file off the event loop"""
         try:
-            layout = template.get('layout_json', {})
-            
-            # Load Jinja template
-            jinja_template = self.env.get_template('invoice.html')
-            
-            # Prepare template context
-            context = {
-                'invoice': invoice_data,
-                'layout': layout,
-                'colors': layout.get('colors', {}),
-                'fonts': layout.get('fonts', {}),
-                'header': layout.get('header', {}),
-                'footer': layout.get('footer', {}),
-                'fields': layout.get('fields', {}),
-                'columns': sorted(layout.get('columns', []), key=lambda x: x.get('order', 0)),
-                'logo_url': layout.get('logo_url'),
-                'now': datetime.now()
-            }
-            
-            # Render HTML
-            html_content = jinja_template.render(**context)
-            
-            # Generate CSS
-            css_content = self._generate_css(layout)
-            
-            # Create PDF
-            html_doc = HTML(string=html_content)
-            css_doc = CSS(string=css_content)
-            
-            # Save to temp file
+            # Save to temp file (WeasyPrint is CPU-bound, keep it off the event loop)
             temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-            html_doc.write_pdf(temp_file.name, stylesheets=[css_doc])
+            await asyncio.to_thread(
+                self._write_pdf,
+                invoice_data,
+                template,
+                temp_file.name,
+                profile,
+                logo_url
+            )
+            
+            self.last_output_bytes = os.path.getsize(temp_file.name)
+            _output_stats['renders'] += 1
+            _output_stats['bytes_total'] += self.last_output_bytes
+            _output_stats['last_bytes'] = self.last_output_bytes
             
             return temp_file.name
             
         except Exception as e:
-            print(f"Error generating PDF: {e}")
+            log_event(logger, "pdf.render_failed", logging.ERROR, exc_info=e, profile=profile)
             raise
     
+    def _write_pdf(
+        self,
+        invoice_data: InvoiceData,
+        template: Dict[str, Any],
+        path: str,
+        profile: str,
+        logo_url: Optional[str] = None
+    ):
+        """Build the documents and write the PDF; runs in a worker thread"""
+        html_doc, css_doc = self._build_documents(invoice_data, template, logo_url)
+        html_doc.write_pdf(path, stylesheets=[css_doc], **self._write_options(profile))
+    
+    def _write_options(self, profile: str) -> Dict[str, Any]:
+        """
+        WeasyPrint write_pdf options for an output profile. Fonts are already
+        subset by default; compact recompresses and caps the resolution of images.
+        """
+        if profile == COMPACT:
+            return {
+                'optimize_images': True,
+                'jpeg_quality': settings.PDF_JPEG_QUALITY,
+                'dpi': settings.PDF_IMAGE_DPI
+            }
+        return {}
+    
+    async def _compact_logo(self, logo_url: str) -> str:
+        """Downsample and recompress a logo once, returning it as a data URI"""
+        if not logo_url.startswith(('http://', 'https://')):
+            return logo_url
+        
+        # Downsampling settings are part of the key so a config change re-encodes
+        cache_key = (
+            f"{settings.PDF_LOGO_MAX_WIDTH_PX}x{settings.PDF_LOGO_MAX_HEIGHT_PX}"
+            f"q{settings.PDF_JPEG_QUALITY}:{logo_url}"
+        )
+        cached = await asyncio.to_thread(shared_cache.get, ASSETS, cache_key)
+        if cached is not None:
+            return cached.decode()
+        
+        try:
+            response = await get_http_client().get(logo_url, timeout=10)
+            response.raise_for_status()
+            data_uri = await asyncio.to_thread(self._downsample_logo, response.content)
+        except Exception as e:
+            # Fall back to letting WeasyPrint fetch the original
+            log_event(logger, "pdf.logo_compact_failed", logging.WARNING, exc_info=e, logo_url=logo_url)
+            return logo_url
+        
+        await asyncio.to_thread(shared_cache.set, ASSETS, cache_key, data_uri.encode())
+        
+        return data_uri
+    
+    def _downsample_logo(self, content: bytes) -> str:
+        """Shrink a logo to the size it is printed at and re-encode it"""
+        image = Image.open(io.BytesIO(content))
+        image.thumbnail((settings.PDF_LOGO_MAX_WIDTH_PX, settings.PDF_LOGO_MAX_HEIGHT_PX))
+        
+        buffer = io.BytesIO()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Keep transparency
+            image.save(buffer, format='PNG', optimize=True)
+            mime = 'image/png'
+        else:
+            image.convert('RGB').save(buffer, format='JPEG', quality=settings.PDF_JPEG_QUALITY, optimize=True)
+            mime = 'image/jpeg'
+        
+        return f"data:{mime};base64,{base64.b64encode(buffer.getvalue()).decode()}"
+    
+    async def generate_preview_png(
+        self,
+        template: Dict[str, Any],
+        resolution: int = 96,
+        organization_id: Optional[str] = None
+    ) -> bytes:
+        """Render the first page of a template preview as a PNG thumbnail"""
+        layout = template.get('layout_json', {})
+        # Like the bytecode cache, keyed on the template source so an edit invalidates
+        template_hash = await asyncio.to_thread(self._template_hash)
+        cache_key = f"{template_hash}:{self._layout_hash(layout)}:{resolution}"
+        
+        cached = await asyncio.to_thread(shared_cache.get, PREVIEWS, cache_key)
+        if cached is not None:
+            return cached
+        
+        async with render_admission.slot(INTERACTIVE, organization_id):
+            try:
+                png = await asyncio.to_thread(
+                    self._preview_png, self.get_sample_invoice_data(), template, resolution
+                )
+            except Exception as e:
+                log_event(logger, "pdf.preview_failed", logging.ERROR, exc_info=e, resolution=resolution)
+                raise
+        
+        await asyncio.to_thread(shared_cache.set, PREVIEWS, cache_key, png)
+        
+        return png
+    
+    async def warm_up(self):
+        """
+        Compile the invoice template and run one throwaway render, so font
+        discovery and first-use setup happen before real traffic arrives
+        """
+        await asyncio.to_thread(self._preview_png, self.get_sample_invoice_data(), {'layout_json': {}}, 24)
+    
+    def _preview_png(
+        self,
+        invoice_data: InvoiceData,
+        template: Dict[str, Any],
+        resolution: int
+    ) -> bytes:
+        """Build the documents and rasterize page one; runs in a worker thread"""
+        html_doc, css_doc = self._build_documents(invoice_data, template)
+        return self._first_page_png(html_doc, css_doc, resolution)
+    
+    def _first_page_png(
+        self,
+        html_doc: HTML,
+        css_doc: CSS,
+        resolution: int
+    ) -> bytes:
+        """
+        Lay out the whole document, then write and rasterize only page one.
+        WeasyPrint cannot stop layout early, so the saving is in PDF output
+        and rasterization; preview input is the one-page sample invoice.
+        """
+        document = html_doc.render(stylesheets=[css_doc])
+        first_page_pdf = document.copy(document.pages[:1]).write_pdf()
+        
+        pdf = pdfium.PdfDocument(first_page_pdf)
+        try:
+            image = pdf[0].render(scale=resolution / 72).to_pil()
+        finally:
+            pdf.close()
+        
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue()
+    
+    def _template_hash(self) -> str:
+        """Hash of the invoice.html source; reads the file, so call it off the event loop"""
+        source, _, _ = self.env.loader.get_source(self.env, 'invoice.html')
+        return hashlib.sha256(source.encode()).hexdigest()
+    
+    def _layout_hash(self, layout: Dict[str, Any]) -> str:
+        """Stable hash of a template layout"""
+        return hashlib.sha256(json.dumps(layout, sort_keys=True, default=str).encode()).hexdigest()
+    
+    def _build_documents(
+        self,
+        invoice_data: InvoiceData,
+        template: Dict[str, Any],
+        logo_url: Optional[str] = None
+    ) -> Tuple[HTML, CSS]:
+        """
+        Render the Jinja template and layout CSS into WeasyPrint documents.
+        Loading the template can read the SQLite bytecode cache, so call this
+        from a worker thread, never on the event loop.
+        """
+        layout = template.get('layout_json', {})
+        
+        # Load Jinja template
+        jinja_template = self.env.get_template('invoice.html')
+        
+        # Prepare template context
+        context = {
+            'invoice': invoice_data,
+            'layout': layout,
+            'colors': layout.get('colors', {}),
+            'fonts': layout.get('fonts', {}),
+            'header': layout.get('header', {}),
+            'footer': layout.get('footer', {}),
+            'fields': layout.get('fields', {}),
+            'columns': sorted(layout.get('columns', []), key=lambda x: x.get('order', 0)),
+            'logo_url': logo_url or layout.get('logo_url'),
+            'now': datetime.now()
+        }
+        
+        # Render HTML
+        html_content = jinja_template.render(**context)
+        
+        # Generate CSS
+        css_content = self._generate_css(layout)
+        
+        return HTML(string=html_content), CSS(string=css_content)
+    
+    @staticmethod
+    def get_render_stats() -> Dict[str, Any]:
+        """Output sizes across renders in this process"""
+        renders = _output_stats['renders']
+        return {
+            'profile': settings.PDF_OUTPUT_PROFILE,
+            'renders': renders,
+            'last_bytes': _output_stats['last_bytes'],
+            'avg_bytes': _output_stats['bytes_total'] / renders if renders else 0
+        }
+    
     def _generate_css(self, layout: Dict[str, Any]) -> str:
         """Generate CSS from layout configuration"""
         colors = layout.get('colors', {})
@@ -210,50 +433,49 @@ class PDFService:
         
         return css
     
-    def get_sample_invoice_data(self) -> Dict[str, Any]:
+    def get_sample_invoice_data(self) -> InvoiceData:
         """Get sample invoice data for preview"""
-        return {
-            'customer_id': 'CUST001',
-            'customer_name': 'Sample Customer',
-            'customer_address': '123 Main St, City, State 12345',
-            'customer_email': 'customer@example.com',
-            'invoice_number': 'INV-000001',
-            'invoice_date': datetime.now().date().isoformat(),
-            'invoice_period_start': datetime.now().date().isoformat(),
-            'invoice_period_end': datetime.now().date().isoformat(),
-            'line_items': [
-                {
-                    'description': 'Oxygen Cylinder 40L',
-                    'barcode': 'BC001',
-                    'serial_number': 'SN001',
-                    'rental_start_date': datetime.now().date().isoformat(),
-                    'rental_days': 30,
-                    'quantity': 1,
-                    'unit_price': 5.00,
-                    'total_price': 150.00
-                },
-                {
-                    'description': 'Nitrogen Cylinder 20L',
-                    'barcode': 'BC002',
-                    'serial_number': 'SN002',
-                    'rental_start_date': datetime.now().date().isoformat(),
-                    'rental_days': 30,
-                    'quantity': 1,
-                    'unit_price': 4.00,
-                    'total_price': 120.00
-                }
+        today = datetime.now().date().isoformat()
+        return InvoiceData(
+            customer_id='CUST001',
+            customer_name='Sample Customer',
+            customer_address='123 Main St, City, State 12345',
+            customer_email='customer@example.com',
+            invoice_number='INV-000001',
+            invoice_date=today,
+            invoice_period_start=today,
+            invoice_period_end=today,
+            line_items=[
+                LineItem(
+                    description='Oxygen Cylinder 40L',
+                    barcode='BC001',
+                    serial_number='SN001',
+                    rental_start_date=today,
+                    rental_days=30,
+                    quantity=1,
+                    unit_price=5.00,
+                    total_price=150.00
+                ),
+                LineItem(
+                    description='Nitrogen Cylinder 20L',
+                    barcode='BC002',
+                    serial_number='SN002',
+                    rental_start_date=today,
+                    rental_days=30,
+                    quantity=1,
+                    unit_price=4.00,
+                    total_price=120.00
+                )
             ],
-            'subtotal': 270.00,
-            'tax_amount': 29.70,
-            'tax_rate': 0.11,
-            'total_amount': 299.70,
-            'organization_name': 'Sample Company',
-            'organization_address': '456 Business Ave, City, State 67890',
-            'organization_phone': '(555) 123-4567',
-            'organization_email': 'info@sample.com',
-            'organization_logo_url': None,
-            'payment_terms': 'Net 30',
-            'invoice_notes': 'Thank you for your business!',
-            'invoice_footer': 'This is a sample invoice footer.'
-        }
+            subtotal=270.00,
+            tax_amount=29.70,
+            tax_rate=0.11,
+            total_amount=299.70,
+            organization_name='Sample Company',
+            organization_address='456 Business Ave, City, State 67890',
+            organization_phone='(555) 123-4567',
+            organization_email='info@sample.com',
+            payment_terms='Net 30',
+            invoice_notes='Thank you for your business!'
+        )
 
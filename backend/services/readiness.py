@@ -0,0 +1,179 @@
+"""
+Startup warm-up and readiness probes for Supabase, Storage and SMTP
+"""
+import asyncio
+import logging
+import time
+import aiosmtplib
+from typing import Optional, Dict, Any, Awaitable, Callable
+from ..config import settings
+from .log import get_logger, log_event
+from .admission import render_admission
+from .circuit_breaker import supabase_breaker, storage_breaker, smtp_breaker
+from .pdf_service import PDFService
+from .supabase_service import create_supabase_client
+
+logger = get_logger("readiness")
+
+
+class WarmUp:
+    """
+    Tracks the one-off warm-up; the worker is not ready until it has succeeded.
+    Failures are retried with exponential backoff instead of leaving the worker
+    unready until it is restarted.
+    """
+
+    def __init__(self, retry_base: float, retry_max: float):
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.ready = False
+        self.error: Optional[str] = None
+        self.duration: Optional[float] = None
+        self.attempts = 0
+        self.next_retry_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, enabled: bool = True):
+        if not enabled:
+            self.ready = True
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            self.attempts += 1
+            started = time.monotonic()
+            try:
+                await PDFService().warm_up()
+            except Exception as e:
+                delay = min(self.retry_max, self.retry_base * (2 ** (self.attempts - 1)))
+                log_event(
+                    logger, "warm_up.failed", logging.ERROR, exc_info=e,
+                    attempt=self.attempts, retry_in_seconds=delay
+                )
+                self.error = str(e)
+                self.next_retry_at = time.monotonic() + delay
+                await asyncio.sleep(delay)
+                continue
+
+            self.duration = time.monotonic() - started
+            self.error = None
+            self.next_retry_at = None
+            self.ready = True
+            return
+
+    def get_status(self) -> Dict[str, Any]:
+        retry_in = None
+        if self.next_retry_at is not None:
+            retry_in = round(max(self.next_retry_at - time.monotonic(), 0.0), 1)
+        return {
+            'ready': self.ready,
+            'duration_seconds': self.duration,
+            'attempts': self.attempts,
+            'error': self.error,
+            # Set while a failed warm-up waits for its next attempt
+            'retry_in_seconds': retry_in
+        }
+
+
+class DependencyProber:
+    """
+    Measures round-trip latency to each dependency. Probes bypass the circuit
+    breakers (so they neither trip them nor use up half-open slots) and results
+    are cached for `ttl` seconds, so frequent load balancer checks stay cheap.
+    """
+
+    def __init__(self, timeout: float, ttl: float):
+        self.timeout = timeout
+        self.ttl = ttl
+        self._results: Optional[Dict[str, Any]] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self._client = None
+
+    async def probe(self) -> Dict[str, Any]:
+        async with self._lock:
+            if self._results is None or time.monotonic() - self._checked_at >= self.ttl:
+                supabase, storage, smtp = await asyncio.gather(
+                    self._measure(self._probe_supabase),
+                    self._measure(self._probe_storage),
+                    self._measure(self._probe_smtp)
+                )
+                supabase['breaker'] = supabase_breaker.state
+                storage['breaker'] = storage_breaker.state
+                smtp['breaker'] = smtp_breaker.state
+                self._results = {'supabase': supabase, 'storage': storage, 'smtp': smtp}
+                self._checked_at = time.monotonic()
+            return self._results
+
+    async def _measure(self, probe: Callable[[], Awaitable[Optional[str]]]) -> Dict[str, Any]:
+        started = time.monotonic()
+        try:
+            status = await asyncio.wait_for(probe(), timeout=self.timeout) or 'ok'
+        except asyncio.TimeoutError:
+            return {'status': 'timeout', 'latency_ms': None}
+        except Exception as e:
+            return {'status': 'error', 'latency_ms': None, 'error': str(e)}
+        return {'status': status, 'latency_ms': round((time.monotonic() - started) * 1000, 1)}
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = create_supabase_client(self.timeout, self.timeout)
+        return self._client
+
+    async def _probe_supabase(self):
+        await supabase_breaker.run_in_executor(
+            self._get_client().table("organizations").select("id").limit(1).execute
+        )
+
+    async def _probe_storage(self):
+        await storage_breaker.run_in_executor(
+            self._get_client().storage.get_bucket, settings.SUPABASE_STORAGE_BUCKET
+        )
+
+    async def _probe_smtp(self):
+        if not settings.SMTP_HOST:
+            return 'not_configured'
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.SMTP_HOST,
+            port=settings.SMTP_PORT,
+            use_tls=True,
+            timeout=self.timeout
+        )
+        await smtp.connect()
+        try:
+            await smtp.noop()
+        finally:
+            smtp.close()
+
+
+def render_saturation() -> Dict[str, Any]:
+    stats = render_admission.get_stats()
+    return {
+        'active': stats['active'],
+        'max_concurrent': stats['max_concurrent'],
+        'queue_depth': stats['queue_depth'],
+        'max_queue': stats['max_queue'],
+        'utilization': stats['active'] / stats['max_concurrent'] if stats['max_concurrent'] else 0.0,
+        'queue_full': stats['queue_depth'] >= stats['max_queue']
+    }
+
+
+warm_up = WarmUp(
+    retry_base=settings.STARTUP_WARMUP_RETRY_BASE_SECONDS,
+    retry_max=settings.STARTUP_WARMUP_RETRY_MAX_SECONDS
+)
+
+dependency_prober = DependencyProber(
+    timeout=settings.READINESS_PROBE_TIMEOUT_SECONDS,
+    ttl=settings.READINESS_PROBE_TTL_SECONDS
+)
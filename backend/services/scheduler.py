@@ -0,0 +1,615 @@
+"""
+In-process scheduler for recurring invoicing during off-peak windows
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import uuid
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+from zoneinfo import ZoneInfo
+from fastapi import HTTPException
+from ..config import settings
+from .log import get_logger, log_event, bind
+from .admission import BATCH
+from .errors import ServiceUnavailable
+from .supabase_service import SupabaseService
+from .accruals import AccrualService
+from .invoice_pipeline import InvoicePipeline
+
+logger = get_logger("scheduler")
+
+# Run states
+PLANNING = "planning"
+ACTIVE = "active"
+COMPLETE = "complete"
+
+# Item states
+PENDING = "pending"
+# Invoice saved, email not queued yet; a restart only queues the email
+GENERATED = "generated"
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+class SystemClock:
+    def __init__(self, timezone: str):
+        self.tz = ZoneInfo(timezone)
+
+    def now(self) -> datetime:
+        return datetime.now(self.tz)
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class SimulatedClock:
+    """Clock for tests: sleeping advances time instantly"""
+
+    def __init__(self, start: datetime):
+        self._now = start
+
+    def now(self) -> datetime:
+        return self._now
+
+    def advance(self, seconds: float):
+        self._now += timedelta(seconds=seconds)
+
+    def set(self, now: datetime):
+        self._now = now
+
+    async def sleep(self, seconds: float):
+        self.advance(seconds)
+        await asyncio.sleep(0)
+
+
+def _parse_time(value: str) -> dt_time:
+    hours, minutes = value.split(":")
+    return dt_time(int(hours), int(minutes))
+
+
+class ScheduleJob:
+    """Recurring monthly invoicing for one organization"""
+
+    def __init__(
+        self,
+        organization_id: str,
+        window_start: str,
+        window_end: str,
+        max_per_minute: float,
+        day_of_month: int,
+        send: bool = True,
+        template_id: Optional[str] = None
+    ):
+        if max_per_minute < 1:
+            raise ValueError(f"max_per_minute must be at least 1 for {organization_id}, got {max_per_minute}")
+        # Every month has these days, so each month's billing day comes round
+        if not 1 <= day_of_month <= 28:
+            raise ValueError(f"day_of_month must be between 1 and 28 for {organization_id}, got {day_of_month}")
+        self.organization_id = organization_id
+        self.window_start = _parse_time(window_start)
+        self.window_end = _parse_time(window_end)
+        self.max_per_minute = max_per_minute
+        self.day_of_month = day_of_month
+        self.send = send
+        self.template_id = template_id
+
+    @classmethod
+    def from_config(cls, job: Dict[str, Any]) -> "ScheduleJob":
+        """Build a job from an INVOICE_SCHEDULE_JOBS entry, filling in the global defaults"""
+        return cls(
+            organization_id=job['organization_id'],
+            window_start=job.get('window_start', settings.INVOICE_SCHEDULE_WINDOW_START),
+            window_end=job.get('window_end', settings.INVOICE_SCHEDULE_WINDOW_END),
+            max_per_minute=job.get('max_per_minute', settings.INVOICE_SCHEDULE_MAX_PER_MINUTE),
+            day_of_month=job.get('day_of_month', settings.INVOICE_SCHEDULE_DAY_OF_MONTH),
+            send=job.get('send', settings.INVOICE_SCHEDULE_SEND),
+            template_id=job.get('template_id')
+        )
+
+    def window_close(self, now: datetime) -> Optional[datetime]:
+        """End of the window containing `now`, or None outside the window"""
+        today = now.date()
+        # A window like 22:00-04:00 may have opened yesterday
+        for opened_on in (today, today - timedelta(days=1)):
+            opens = datetime.combine(opened_on, self.window_start, tzinfo=now.tzinfo)
+            closes = datetime.combine(opened_on, self.window_end, tzinfo=now.tzinfo)
+            if closes <= opens:
+                closes += timedelta(days=1)
+            if opens <= now < closes:
+                return closes
+        return None
+
+    def due_period(self, today: date) -> Optional[Tuple[date, date]]:
+        """The previous calendar month, once its billing day has arrived"""
+        if today.day < self.day_of_month:
+            return None
+        period_end = today.replace(day=1) - timedelta(days=1)
+        return period_end.replace(day=1), period_end
+
+
+class ScheduleStore:
+    """
+    Progress of scheduled runs, one row per (organization, period, customer).
+    Items are leased when claimed, and each job is leased to one worker at a
+    time so its pacing and accruals aren't multiplied by the number of workers.
+    """
+
+    def __init__(self, db_path: str, lease_seconds: float):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schedule_runs (
+                    organization_id TEXT NOT NULL,
+                    period_start TEXT NOT NULL,
+                    period_end TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    completed_at REAL,
+                    PRIMARY KEY (organization_id, period_start)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schedule_items (
+                    organization_id TEXT NOT NULL,
+                    period_start TEXT NOT NULL,
+                    customer_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    invoice_id TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (organization_id, period_start, customer_id)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schedule_leases (
+                    organization_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    lease_until REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schedule_accruals (
+                    organization_id TEXT PRIMARY KEY,
+                    accrued_through TEXT NOT NULL
+                )
+            """)
+            self._initialized = True
+        return conn
+
+    def lease_job(self, organization_id: str, owner: str, now: float, until: float) -> bool:
+        """Take or extend the job's lease; False while another worker holds it"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT owner, lease_until FROM schedule_leases WHERE organization_id = ?",
+                (organization_id,)
+            ).fetchone()
+            held = row is None or row['owner'] == owner or row['lease_until'] <= now
+            if held:
+                conn.execute(
+                    "INSERT OR REPLACE INTO schedule_leases (organization_id, owner, lease_until) VALUES (?, ?, ?)",
+                    (organization_id, owner, until)
+                )
+            conn.execute("COMMIT")
+            return held
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def accrued_through(self, organization_id: str) -> Optional[date]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT accrued_through FROM schedule_accruals WHERE organization_id = ?",
+                (organization_id,)
+            ).fetchone()
+            return date.fromisoformat(row['accrued_through']) if row else None
+        finally:
+            conn.close()
+
+    def record_accrual(self, organization_id: str, through: date):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO schedule_accruals (organization_id, accrued_through) VALUES (?, ?)",
+                (organization_id, through.isoformat())
+            )
+        finally:
+            conn.close()
+
+    def get_run(self, organization_id: str, period_start: date) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT * FROM schedule_runs WHERE organization_id = ? AND period_start = ?",
+                (organization_id, period_start.isoformat())
+            ).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def create_run(self, organization_id: str, period_start: date, period_end: date, now: float):
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO schedule_runs
+                    (organization_id, period_start, period_end, status, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (organization_id, period_start.isoformat(), period_end.isoformat(), PLANNING, now)
+            )
+        finally:
+            conn.close()
+
+    def plan_run(self, organization_id: str, period_start: date, customer_ids: List[str], now: float):
+        """Add the run's items and activate it; safe to repeat after a crash mid-planning"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO schedule_items
+                    (organization_id, period_start, customer_id, status, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [(organization_id, period_start.isoformat(), c, PENDING, now) for c in customer_ids]
+            )
+            conn.execute(
+                "UPDATE schedule_runs SET status = ? WHERE organization_id = ? AND period_start = ? AND status = ?",
+                (ACTIVE, organization_id, period_start.isoformat(), PLANNING)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim_next(self, organization_id: str, max_attempts: int, now: float) -> Optional[Dict[str, Any]]:
+        """Lease the next unfinished item of the organization's oldest active run"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """
+                SELECT i.*, r.period_end FROM schedule_items i
+                JOIN schedule_runs r
+                    ON r.organization_id = i.organization_id AND r.period_start = i.period_start
+                WHERE i.organization_id = ? AND r.status = ?
+                    AND i.status IN (?, ?) AND i.attempts < ? AND i.lease_until <= ?
+                ORDER BY i.period_start, i.attempts, i.customer_id
+                LIMIT 1
+                """,
+                (organization_id, ACTIVE, PENDING, GENERATED, max_attempts, now)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    """
+                    UPDATE schedule_items SET lease_until = ?
+                    WHERE organization_id = ? AND period_start = ? AND customer_id = ?
+                    """,
+                    (now + self.lease_seconds, organization_id, row['period_start'], row['customer_id'])
+                )
+            conn.execute("COMMIT")
+            return dict(row) if row else None
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def update_item(self, item: Dict[str, Any], now: float, **fields):
+        """Record an item's progress and release its lease"""
+        fields['lease_until'] = 0
+        fields['updated_at'] = now
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        try:
+            conn.execute(
+                f"""
+                UPDATE schedule_items SET {assignments}
+                WHERE organization_id = ? AND period_start = ? AND customer_id = ?
+                """,
+                (*fields.values(), item['organization_id'], item['period_start'], item['customer_id'])
+            )
+        finally:
+            conn.close()
+
+    def remaining(self, organization_id: str, max_attempts: int) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute(
+                """
+                SELECT COUNT(*) FROM schedule_items i
+                JOIN schedule_runs r
+                    ON r.organization_id = i.organization_id AND r.period_start = i.period_start
+                WHERE i.organization_id = ? AND r.status = ? AND i.status IN (?, ?) AND i.attempts < ?
+                """,
+                (organization_id, ACTIVE, PENDING, GENERATED, max_attempts)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def complete_runs(self, organization_id: str, max_attempts: int, now: float):
+        """Close active runs with nothing left to retry"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                UPDATE schedule_runs SET status = ?, completed_at = ?
+                WHERE organization_id = ? AND status = ? AND NOT EXISTS (
+                    SELECT 1 FROM schedule_items i
+                    WHERE i.organization_id = schedule_runs.organization_id
+                        AND i.period_start = schedule_runs.period_start
+                        AND i.status IN (?, ?) AND i.attempts < ?
+                )
+                """,
+                (COMPLETE, now, organization_id, ACTIVE, PENDING, GENERATED, max_attempts)
+            )
+        finally:
+            conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        try:
+            runs = {
+                row['status']: row['count']
+                for row in conn.execute("SELECT status, COUNT(*) AS count FROM schedule_runs GROUP BY status")
+            }
+            items = {
+                row['status']: row['count']
+                for row in conn.execute("SELECT status, COUNT(*) AS count FROM schedule_items GROUP BY status")
+            }
+        finally:
+            conn.close()
+
+        return {'runs': runs, 'items': items}
+
+
+class InvoiceScheduler:
+    """
+    Runs each job inside its window: accrues the organization's rentals through
+    yesterday, then generates (and queues emails for) last month's invoices one
+    customer at a time, paced so the work is spread over the rest of the window
+    without exceeding the job's rate limit.
+    """
+
+    def __init__(
+        self,
+        store: ScheduleStore,
+        jobs: List[ScheduleJob],
+        user_id: Optional[str],
+        poll_interval: float,
+        max_attempts: int,
+        clock=None,
+        pipeline_factory=InvoicePipeline,
+        accrual_factory=None
+    ):
+        self.store = store
+        self.jobs = jobs
+        self.user_id = user_id
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.clock = clock or SystemClock(settings.INVOICE_SCHEDULE_TIMEZONE)
+        self.pipeline_factory = pipeline_factory
+        self.accrual_factory = accrual_factory or (lambda: AccrualService(SupabaseService().client))
+        # Identifies this worker's job leases in the shared store
+        self.owner = uuid.uuid4().hex
+        self._tasks: List[asyncio.Task] = []
+        self._stats = {'generated': 0, 'reused': 0, 'queued': 0, 'skipped': 0, 'errors': 0, 'deferred': 0}
+
+    def start(self):
+        if self._tasks:
+            return
+        if not self.user_id:
+            log_event(logger, "scheduler.not_started", logging.WARNING, reason="INVOICE_SCHEDULE_USER_ID is not set")
+            return
+        self._tasks = [asyncio.create_task(self._run(job)) for job in self.jobs]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _run(self, job: ScheduleJob):
+        bind(organization_id=job.organization_id)
+        while True:
+            try:
+                delay = await self.tick(job)
+            except ServiceUnavailable as e:
+                self._stats['deferred'] += 1
+                delay = e.retry_after
+            except Exception as e:
+                log_event(logger, "scheduler.tick_failed", logging.ERROR, exc_info=e)
+                self._stats['errors'] += 1
+                delay = self.poll_interval
+            await self.clock.sleep(delay)
+
+    async def tick(self, job: ScheduleJob) -> float:
+        """Do the next unit of work for a job; returns seconds until the next tick"""
+        now = self.clock.now().timestamp()
+        leased = await asyncio.to_thread(
+            self.store.lease_job, job.organization_id, self.owner, now, now + self.store.lease_seconds
+        )
+        if not leased:
+            # Another worker runs this job; stand by in case it stops
+            return self.poll_interval
+
+        delay = await self._tick(job)
+
+        # Hold the job through the pause, so the pacing is the same across workers
+        now = self.clock.now().timestamp()
+        await asyncio.to_thread(
+            self.store.lease_job, job.organization_id, self.owner, now, now + delay + self.poll_interval
+        )
+        return delay
+
+    async def _tick(self, job: ScheduleJob) -> float:
+        now = self.clock.now()
+        closes = job.window_close(now)
+        if closes is None:
+            return self.poll_interval
+
+        organization_id = job.organization_id
+        yesterday = now.date() - timedelta(days=1)
+        accrued = await asyncio.to_thread(self.store.accrued_through, organization_id)
+        if settings.RENTAL_ACCRUALS_ENABLED and (accrued is None or accrued < yesterday):
+            await self.accrual_factory().accrue_organization(organization_id, through=yesterday)
+            await asyncio.to_thread(self.store.record_accrual, organization_id, yesterday)
+            return 0
+
+        period = job.due_period(now.date())
+        if period:
+            run = await asyncio.to_thread(self.store.get_run, organization_id, period[0])
+            if run is None or run['status'] == PLANNING:
+                await self._plan(job, period)
+
+        item = await asyncio.to_thread(
+            self.store.claim_next, organization_id, self.max_attempts, now.timestamp()
+        )
+        if item is None:
+            await asyncio.to_thread(
+                self.store.complete_runs, organization_id, self.max_attempts, now.timestamp()
+            )
+            return self.poll_interval
+
+        await self._process(job, item)
+
+        # Spread what is left evenly over the rest of the window, never faster than the rate limit
+        remaining = await asyncio.to_thread(self.store.remaining, organization_id, self.max_attempts)
+        min_interval = 60.0 / job.max_per_minute
+        window_left = (closes - self.clock.now()).total_seconds()
+        return max(min_interval, window_left / (remaining + 1))
+
+    async def _plan(self, job: ScheduleJob, period: Tuple[date, date]):
+        now = self.clock.now().timestamp()
+        await asyncio.to_thread(self.store.create_run, job.organization_id, period[0], period[1], now)
+        customer_ids = await self._billable_customers(job.organization_id, period[1])
+        await asyncio.to_thread(self.store.plan_run, job.organization_id, period[0], customer_ids, now)
+
+    async def _billable_customers(self, organization_id: str, period_end: date) -> List[str]:
+        return await SupabaseService().billable_customers(organization_id, period_end)
+
+    async def _process(self, job: ScheduleJob, item: Dict[str, Any]):
+        bind(request_id=f"schedule-{item['period_start']}-{item['customer_id']}")
+        pipeline = self.pipeline_factory()
+        invoice_id = item.get('invoice_id')
+
+        try:
+            if item['status'] == PENDING:
+                period_start = date.fromisoformat(item['period_start'])
+                period_end = date.fromisoformat(item['period_end'])
+                # A crash between saving the invoice and recording it here leaves
+                # the invoice behind; reuse it rather than billing the period twice
+                invoice_id = await pipeline.find_invoice(
+                    organization_id=job.organization_id,
+                    customer_id=item['customer_id'],
+                    period_start=period_start,
+                    period_end=period_end
+                )
+                if invoice_id is None:
+                    result = await pipeline.generate_invoice(
+                        organization_id=job.organization_id,
+                        customer_id=item['customer_id'],
+                        period_start=period_start,
+                        period_end=period_end,
+                        template_id=job.template_id,
+                        user_id=self.user_id,
+                        priority=BATCH
+                    )
+                    invoice_id = result['invoice_id']
+                    self._stats['generated'] += 1
+                else:
+                    self._stats['reused'] += 1
+                if job.send:
+                    await asyncio.to_thread(
+                        self.store.update_item, item, self.clock.now().timestamp(),
+                        status=GENERATED, invoice_id=invoice_id
+                    )
+
+            if job.send:
+                await pipeline.queue_invoice_email(
+                    organization_id=job.organization_id,
+                    invoice_id=invoice_id,
+                    template_id=job.template_id
+                )
+                self._stats['queued'] += 1
+
+        except ServiceUnavailable:
+            # Not the item's fault; release it untouched and back off
+            await asyncio.to_thread(
+                self.store.update_item, item, self.clock.now().timestamp(), invoice_id=invoice_id
+            )
+            raise
+        except HTTPException as e:
+            # Nothing to bill (404) or no address to send to (400); retrying won't help
+            self._stats['skipped'] += 1
+            await asyncio.to_thread(
+                self.store.update_item, item, self.clock.now().timestamp(),
+                status=SKIPPED, invoice_id=invoice_id, last_error=str(e.detail)
+            )
+            return
+        except Exception as e:
+            self._stats['errors'] += 1
+            attempts = item['attempts'] + 1
+            await asyncio.to_thread(
+                self.store.update_item, item, self.clock.now().timestamp(),
+                status=FAILED if attempts >= self.max_attempts else (GENERATED if invoice_id else PENDING),
+                invoice_id=invoice_id,
+                attempts=attempts,
+                last_error=str(e)
+            )
+            return
+
+        await asyncio.to_thread(
+            self.store.update_item, item, self.clock.now().timestamp(),
+            status=DONE, invoice_id=invoice_id, last_error=None
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'running': bool(self._tasks),
+            'jobs': len(self.jobs),
+            **self._stats,
+            **self.store.get_stats()
+        }
+
+
+schedule_store = ScheduleStore(
+    db_path=os.path.join(settings.LOCAL_DATA_DIR, "scheduler.sqlite3"),
+    lease_seconds=settings.INVOICE_SCHEDULE_LEASE_SECONDS
+)
+
+invoice_scheduler = InvoiceScheduler(
+    store=schedule_store,
+    jobs=[ScheduleJob.from_config(job) for job in settings.INVOICE_SCHEDULE_JOBS],
+    user_id=settings.INVOICE_SCHEDULE_USER_ID,
+    poll_interval=settings.INVOICE_SCHEDULE_POLL_SECONDS,
+    max_attempts=settings.INVOICE_SCHEDULE_MAX_ATTEMPTS
+)
@@ -0,0 +1,182 @@
+"""
+Host-wide cache shared by all workers, backed by SQLite
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any
+from jinja2 import BytecodeCache
+from ..config import settings
+
+# Namespaces
+PREVIEWS = "preview"
+ASSETS = "asset"
+TEMPLATES = "template"
+
+# Don't rewrite accessed_at on every hit; LRU order only needs to be roughly right
+TOUCH_INTERVAL_SECONDS = 5.0
+EVICT_BATCH = 64
+
+
+class SharedCache:
+    """
+    Byte values by (namespace, key) in one SQLite file under LOCAL_DATA_DIR.
+    WAL mode lets every worker read concurrently; writes and eviction run in
+    BEGIN IMMEDIATE transactions so the size bound holds across processes.
+    Entries survive restarts, so a new worker starts warm.
+    """
+
+    def __init__(self, db_path: str, max_bytes: int):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._initialized = False
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; lookups are too frequent to reconnect each time
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_lru ON cache_entries (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 1), bytes INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO cache_size (id, bytes) VALUES (1, 0)")
+            self._initialized = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._local.conn = conn
+        return conn
+
+    def _count(self, namespace: str, outcome: str):
+        stats = self._stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'sets': 0})
+        stats[outcome] += 1
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, accessed_at FROM cache_entries WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        if row is None:
+            self._count(namespace, 'misses')
+            return None
+
+        now = time.time()
+        if now - row[1] > TOUCH_INTERVAL_SECONDS:
+            conn.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key)
+            )
+        self._count(namespace, 'hits')
+        return row[0]
+
+    def set(self, namespace: str, key: str, value: bytes):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            previous = conn.execute(
+                "SELECT size FROM cache_entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, value, size, time.time())
+            )
+            conn.execute(
+                "UPDATE cache_size SET bytes = bytes + ? WHERE id = 1",
+                (size - (previous[0] if previous else 0),)
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        self._count(namespace, 'sets')
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Drop least recently used entries until the cache fits; runs inside the write transaction"""
+        total = conn.execute("SELECT bytes FROM cache_size WHERE id = 1").fetchone()[0]
+        while total > self.max_bytes:
+            victims = conn.execute(
+                "SELECT namespace, key, size FROM cache_entries ORDER BY accessed_at LIMIT ?",
+                (EVICT_BATCH,)
+            ).fetchall()
+            if not victims:
+                break
+            for namespace, key, size in victims:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+                total -= size
+        conn.execute("UPDATE cache_size SET bytes = ? WHERE id = 1", (max(total, 0),))
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        entries = {
+            row[0]: {'entries': row[1], 'bytes': row[2]}
+            for row in conn.execute(
+                "SELECT namespace, COUNT(*), SUM(size) FROM cache_entries GROUP BY namespace"
+            )
+        }
+        namespaces = {}
+        for namespace in set(entries) | set(self._stats):
+            stats = self._stats.get(namespace, {'hits': 0, 'misses': 0, 'sets': 0})
+            lookups = stats['hits'] + stats['misses']
+            namespaces[namespace] = {
+                **entries.get(namespace, {'entries': 0, 'bytes': 0}),
+                **stats,
+                'hit_rate': stats['hits'] / lookups if lookups else 0.0
+            }
+
+        return {
+            'bytes': conn.execute("SELECT bytes FROM cache_size WHERE id = 1").fetchone()[0],
+            'max_bytes': self.max_bytes,
+            # Hits and misses are this worker's; entries and bytes are host-wide
+            'namespaces': namespaces
+        }
+
+
+class SharedBytecodeCache(BytecodeCache):
+    """Jinja bytecode cache in the shared store, so templates compile once per host"""
+
+    def __init__(self, cache: SharedCache):
+        self.cache = cache
+
+    def load_bytecode(self, bucket):
+        data = self.cache.get(TEMPLATES, bucket.key)
+        if data is not None:
+            # Jinja checks the source checksum and discards stale code itself
+            bucket.bytecode_from_string(data)
+
+    def dump_bytecode(self, bucket):
+        self.cache.set(TEMPLATES, bucket.key, bucket.bytecode_to_string())
+
+    def clear(self):
+        pass
+
+
+shared_cache = SharedCache(
+    db_path=os.path.join(settings.LOCAL_DATA_DIR, "shared_cache.sqlite3"),
+    max_bytes=settings.SHARED_CACHE_MAX_MB * 1024 * 1024
+)
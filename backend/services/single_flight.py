@@ -0,0 +1,48 @@
+"""
+Single-flight coalescing of identical concurrent requests
+"""
+import asyncio
+from typing import Dict, Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._calls = 0
+        self._coalesced = 0
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Run fn once per key; concurrent callers with the same key share the result"""
+        self._calls += 1
+        task = self._inflight.get(key)
+
+        if task is not None:
+            self._coalesced += 1
+        else:
+            # Run as its own task so one caller disconnecting doesn't cancel the others
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'in_flight': len(self._inflight),
+            'calls': self._calls,
+            'coalesced': self._coalesced
+        }
+
+
+request_coalescer = SingleFlight()
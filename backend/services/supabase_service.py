@@ -2,19 +2,56 @@
 Supabase Service for database operations
 """
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
 from typing import Optional, Dict, Any, List
 from datetime import date, datetime
+import asyncio
+import logging
 import os
 import tempfile
 import aiofiles
 from ..config import settings
+from .log import get_logger, log_event
+from .pdf_cache import pdf_cache, get_http_client
+from .accruals import AccrualService, daily_rate, PAGE_SIZE
+from .invoice_models import InvoiceData, LineItem
+from .circuit_breaker import supabase_breaker, storage_breaker, CircuitOpenError, DEPENDENCY_ERRORS
+
+logger = get_logger("supabase")
+
+def create_supabase_client(
+    postgrest_timeout: float = settings.SUPABASE_TIMEOUT_SECONDS,
+    storage_timeout: float = settings.STORAGE_TIMEOUT_SECONDS
+) -> Client:
+    """
+    Service-role client whose HTTP calls time out on their own, so a thread
+    blocked on a hung request returns instead of outliving the breaker timeout
+    """
+    return create_client(
+        settings.SUPABASE_URL,
+        settings.SUPABASE_SERVICE_KEY,
+        options=ClientOptions(
+            postgrest_client_timeout=postgrest_timeout,
+            storage_client_timeout=storage_timeout
+        )
+    )
 
 class SupabaseService:
     def __init__(self):
-        self.client: Client = create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_SERVICE_KEY
-        )
+        self.client: Client = create_supabase_client()
+    
+    async def _execute(self, query):
+        """Run a PostgREST query off the event loop through the Supabase breaker"""
+        return await supabase_breaker.call_sync(query.execute)
+    
+    async def _get_one(self, query) -> Optional[Dict[str, Any]]:
+        """
+        First row of a query, or None when there is none. Unlike .single(),
+        "no rows" is not an exception, so every exception is a real failure
+        and callers let it propagate instead of reporting "not found".
+        """
+        response = await self._execute(query.limit(1))
+        return response.data[0] if response.data else None
     
     async def get_template(
         self,
@@ -22,28 +59,18 @@ class SupabaseService:
         template_id: Optional[str] = None
     ) -> Optional[Dict[str, Any]]:
         """Get invoice template"""
-        try:
-            query = self.client.table("invoice_templates").select("*").eq("organization_id", organization_id)
-            
-            if template_id:
-                query = query.eq("id", template_id)
-            else:
-                # Get default template
-                query = query.eq("is_default", True)
-            
-            response = query.single().execute()
-            return response.data if response.data else None
-            
-        except Exception as e:
-            # If no default template, try to get any template
-            if not template_id:
-                try:
-                    response = self.client.table("invoice_templates").select("*").eq("organization_id", organization_id).limit(1).execute()
-                    if response.data and len(response.data) > 0:
-                        return response.data[0]
-                except:
-                    pass
-            return None
+        query = self.client.table("invoice_templates").select("*").eq("organization_id", organization_id)
+        
+        if template_id:
+            return await self._get_one(query.eq("id", template_id))
+        
+        # Default template, else any of the organization's templates
+        template = await self._get_one(query.eq("is_default", True))
+        if template is None:
+            template = await self._get_one(
+                self.client.table("invoice_templates").select("*").eq("organization_id", organization_id)
+            )
+        return template
     
     async def get_invoice_data(
         self,
@@ -51,128 +78,151 @@ class SupabaseService:
         customer_id: str,
         period_start: date,
         period_end: date
-    ) -> Optional[Dict[str, Any]]:
+    ) -> Optional[InvoiceData]:
         """Get invoice data including rentals and line items"""
         try:
-            # Get customer info
-            customer = self.client.table("customers").select("*").eq("CustomerListID", customer_id).eq("organization_id", organization_id).single().execute()
+            # Get customer info; an unknown customer is the only "no data" outcome
+            customer = await self._get_one(self.client.table("customers").select("*").eq("CustomerListID", customer_id).eq("organization_id", organization_id))
+            if customer is None:
+                return None
             
-            # Get active rentals
-            rentals = self.client.table("rentals").select("*, bottles(*)").eq("customer_id", customer_id).eq("status", "active").execute()
+            # Active rentals that started by the end of the period, with their
+            # accrued totals when the ledger is enabled (one RPC instead of two reads)
+            rentals = await self._get_ledger_rentals(organization_id, customer_id, period_start, period_end)
+            if rentals is None:
+                response = await self._execute(self.client.table("rentals").select("*, bottles(*)").eq("customer_id", customer_id).eq("status", "active").lte("rental_start_date", period_end.isoformat()))
+                rentals = response.data or []
             
             # Get invoice settings
-            settings = self.client.table("invoice_settings").select("*").eq("organization_id", organization_id).single().execute()
+            invoice_settings = await self._get_one(self.client.table("invoice_settings").select("*").eq("organization_id", organization_id)) or {}
             
             # Get organization info
-            org = self.client.table("organizations").select("*").eq("id", organization_id).single().execute()
+            org = await self._get_one(self.client.table("organizations").select("*").eq("id", organization_id)) or {}
             
             # Calculate line items
             line_items = []
             subtotal = 0
             
-            for rental in rentals.data:
+            for rental in rentals:
                 rental_start = date.fromisoformat(rental['rental_start_date'])
-                days = (period_end - max(rental_start, period_start)).days + 1
+                days = max((period_end - max(rental_start, period_start)).days + 1, 0)
                 
-                # Get rate
-                rate = rental.get('rental_amount') or rental.get('daily_rate', 0)
-                if rental.get('billing_frequency') == 'yearly':
-                    rate = rate / 365  # Convert yearly to daily
+                accrued_days, accrued_amount = rental.get('accrued', (0, 0.0))
+                if accrued_days == days:
+                    # Ledger covers the whole period; use what was recorded day by day
+                    total = accrued_amount
+                    rate = total / days if days else 0
+                else:
+                    # Ledger is behind (or disabled); compute from the current rate
+                    rate = daily_rate(rental)
+                    total = days * rate
                 
-                total = days * rate
                 subtotal += total
                 
-                line_items.append({
-                    'description': rental.get('bottles', {}).get('description', 'Cylinder'),
-                    'barcode': rental.get('bottle_barcode', ''),
-                    'serial_number': rental.get('bottles', {}).get('serial_number', ''),
-                    'rental_start_date': rental['rental_start_date'],
-                    'rental_days': days,
-                    'quantity': 1,
-                    'unit_price': rate,
-                    'total_price': total
-                })
+                bottle = rental.get('bottles') or {}
+                line_items.append(LineItem(
+                    description=bottle.get('description') or 'Cylinder',
+                    barcode=rental.get('bottle_barcode') or '',
+                    serial_number=bottle.get('serial_number') or '',
+                    rental_start_date=rental['rental_start_date'],
+                    rental_days=days,
+                    quantity=1,
+                    unit_price=rate,
+                    total_price=total
+                ))
             
             # Calculate tax
-            tax_rate = settings.data.get('tax_rate', 0.11) if settings.data else 0.11
+            tax_rate = invoice_settings.get('tax_rate', 0.11)
             tax_amount = subtotal * tax_rate
             total_amount = subtotal + tax_amount
             
-            # Invoice number will be auto-generated by database trigger, but we can show what it will be
-            invoice_prefix = settings.data.get('invoice_prefix', 'INV') if settings.data else 'INV'
-            next_number = settings.data.get('next_invoice_number', 1) if settings.data else 1
-            invoice_number = f"{invoice_prefix}{str(next_number).zfill(6)}"
-            
             # Build organization address
             org_address_parts = [
-                org.data.get('address', ''),
-                org.data.get('city', ''),
-                org.data.get('state', ''),
-                org.data.get('postal_code', '')
+                org.get('address', ''),
+                org.get('city', ''),
+                org.get('state', ''),
+                org.get('postal_code', '')
             ]
             org_address = ', '.join([p for p in org_address_parts if p])
             
-            return {
-                'customer_id': customer_id,
-                'customer_name': customer.data.get('name', ''),
-                'customer_address': customer.data.get('address', ''),
-                'customer_email': customer.data.get('email', ''),
-                'invoice_number': invoice_number,
-                'invoice_date': date.today().isoformat(),
-                'invoice_period_start': period_start.isoformat(),
-                'invoice_period_end': period_end.isoformat(),
-                'line_items': line_items,
-                'subtotal': subtotal,
-                'tax_amount': tax_amount,
-                'tax_rate': tax_rate,
-                'total_amount': total_amount,
-                'organization_name': org.data.get('name', '') if org.data else '',
-                'organization_address': org_address,
-                'organization_phone': org.data.get('phone', '') if org.data else '',
-                'organization_email': org.data.get('email', '') if org.data else '',
-                'organization_logo_url': org.data.get('logo_url', '') if org.data else '',
-                'payment_terms': settings.data.get('payment_terms', 'Net 30') if settings.data else 'Net 30',
-                'invoice_notes': settings.data.get('invoice_notes', '') if settings.data else ''
-            }
+            return InvoiceData(
+                customer_id=customer_id,
+                customer_name=customer.get('name') or '',
+                customer_address=customer.get('address') or '',
+                customer_email=customer.get('email') or '',
+                # Assigned by the pipeline once the invoice is known to be renderable
+                invoice_number='',
+                invoice_date=date.today().isoformat(),
+                invoice_period_start=period_start.isoformat(),
+                invoice_period_end=period_end.isoformat(),
+                line_items=line_items,
+                subtotal=subtotal,
+                tax_amount=tax_amount,
+                tax_rate=tax_rate,
+                total_amount=total_amount,
+                organization_name=org.get('name') or '',
+                organization_address=org_address,
+                organization_phone=org.get('phone') or '',
+                organization_email=org.get('email') or '',
+                organization_logo_url=org.get('logo_url') or '',
+                payment_terms=invoice_settings.get('payment_terms', 'Net 30'),
+                invoice_notes=invoice_settings.get('invoice_notes') or ''
+            )
             
+        except DEPENDENCY_ERRORS:
+            raise
         except Exception as e:
-            print(f"Error getting invoice data: {e}")
+            # Raised, not turned into None: callers would report a transient failure as "not found"
+            log_event(logger, "supabase.invoice_data_failed", logging.ERROR, exc_info=e, customer_id=customer_id)
+            raise
+    
+    async def _get_ledger_rentals(
+        self,
+        organization_id: str,
+        customer_id: str,
+        period_start: date,
+        period_end: date
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Rentals shaped like the rentals/bottles select plus an `accrued`
+        (days, amount) pair, or None when the ledger is disabled or unavailable
+        """
+        if not settings.RENTAL_ACCRUALS_ENABLED:
             return None
+        try:
+            lines = await AccrualService(self.client).invoice_lines(
+                organization_id, customer_id, period_start, period_end
+            )
+        except DEPENDENCY_ERRORS:
+            raise
+        except Exception as e:
+            log_event(logger, "supabase.accruals_read_failed", logging.WARNING, exc_info=e, customer_id=customer_id)
+            return None
+        
+        return [
+            {
+                'id': line['rental_id'],
+                'rental_start_date': line['rental_start_date'],
+                'rental_amount': line['rental_amount'],
+                'billing_frequency': line['billing_frequency'],
+                'bottle_barcode': line['bottle_barcode'],
+                'bottles': {
+                    'description': line['bottle_description'],
+                    'serial_number': line['bottle_serial_number']
+                },
+                'accrued': (line['accrued_days'], float(line['accrued_amount']))
+            }
+            for line in lines
+        ]
     
     async def get_invoice_data_from_id(
         self,
         invoice_id: str,
         organization_id: str
-    ) -> Optional[Dict[str, Any]]:
+    ) -> Optional[InvoiceData]:
         """Get invoice data from invoice ID"""
-        try:
-            invoice = self.client.table("rental_invoices").select("*, invoice_line_items(*)").eq("id", invoice_id).eq("organization_id", organization_id).single().execute()
-            
-            if not invoice.data:
-                return None
-            
-            invoice_data = invoice.data
-            line_items = invoice_data.get('invoice_line_items', [])
-            
-            return {
-                'customer_id': invoice_data.get('customer_id', ''),
-                'customer_name': invoice_data.get('customer_name', ''),
-                'customer_address': invoice_data.get('customer_address', ''),
-                'customer_email': invoice_data.get('customer_email', ''),
-                'invoice_number': invoice_data.get('invoice_number', ''),
-                'invoice_date': invoice_data.get('invoice_date', ''),
-                'invoice_period_start': invoice_data.get('invoice_period_start', ''),
-                'invoice_period_end': invoice_data.get('invoice_period_end', ''),
-                'line_items': line_items,
-                'subtotal': float(invoice_data.get('subtotal', 0)),
-                'tax_amount': float(invoice_data.get('tax_amount', 0)),
-                'total_amount': float(invoice_data.get('total_amount', 0)),
-                'notes': invoice_data.get('notes', '')
-            }
-            
-        except Exception as e:
-            print(f"Error getting invoice data from ID: {e}")
-            return None
+        invoice = await self._get_one(self.client.table("rental_invoices").select("*, invoice_line_items(*)").eq("id", invoice_id).eq("organization_id", organization_id))
+        return InvoiceData.from_row(invoice) if invoice else None
     
     async def get_invoice_by_id(
         self,
@@ -180,11 +230,7 @@ class SupabaseService:
         organization_id: str
     ) -> Optional[Dict[str, Any]]:
         """Get invoice by ID"""
-        try:
-            response = self.client.table("rental_invoices").select("*").eq("id", invoice_id).eq("organization_id", organization_id).single().execute()
-            return response.data if response.data else None
-        except Exception as e:
-            return None
+        return await self._get_one(self.client.table("rental_invoices").select("*").eq("id", invoice_id).eq("organization_id", organization_id))
     
     async def upload_pdf(
         self,
@@ -197,112 +243,173 @@ class SupabaseService:
             file_name = f"{invoice_number}.pdf"
             storage_path = f"{organization_id}/{file_name}"
             
-            with open(file_path, 'rb') as f:
-                self.client.storage.from_(settings.SUPABASE_STORAGE_BUCKET).upload(
-                    path=storage_path,
-                    file=f,
-                    file_options={"content-type": "application/pdf", "upsert": "true"}
-                )
+            def upload():
+                with open(file_path, 'rb') as f:
+                    self.client.storage.from_(settings.SUPABASE_STORAGE_BUCKET).upload(
+                        path=storage_path,
+                        file=f,
+                        file_options={"content-type": "application/pdf", "upsert": "true"}
+                    )
+            
+            await storage_breaker.call_sync(upload)
             
             # Get public URL
             url_response = self.client.storage.from_(settings.SUPABASE_STORAGE_BUCKET).get_public_url(storage_path)
             return url_response
             
         except Exception as e:
-            print(f"Error uploading PDF: {e}")
+            log_event(logger, "storage.upload_failed", logging.ERROR, exc_info=e, invoice_number=invoice_number)
             raise
     
     async def download_pdf(
         self,
-        pdf_url: str
-    ) -> str:
-        """Download PDF from URL to temporary file"""
+        pdf_url: str,
+        invoice_id: Optional[str] = None,
+        content_hash: Optional[str] = None
+    ) -> bytes:
+        """
+        Get the contents of a stored PDF.
+        Served from the local PDF cache when the cached copy matches the
+        invoice's stored pdf_sha256; misses are streamed over a shared
+        keep-alive client (or the Storage API) and cached.
+        """
+        # Without a stored hash a cached copy can't be told apart from a stale one
+        if invoice_id and content_hash:
+            cached = await asyncio.to_thread(pdf_cache.get, invoice_id, content_hash)
+            if cached is not None:
+                return cached
+        
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+        temp_file.close()
+        
         try:
-            import httpx
-            async with httpx.AsyncClient() as client:
-                response = await client.get(pdf_url)
-                response.raise_for_status()
-                
-                # Save to temp file
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+            async def stream_to_file():
+                client = get_http_client()
+                async with client.stream("GET", pdf_url) as response:
+                    response.raise_for_status()
+                    async with aiofiles.open(temp_file.name, 'wb') as f:
+                        async for chunk in response.aiter_bytes():
+                            await f.write(chunk)
+            
+            try:
+                await storage_breaker.call(stream_to_file)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                storage_path = self._storage_path_from_url(pdf_url)
+                if not storage_path:
+                    raise
+                log_event(logger, "storage.public_download_failed", logging.WARNING, exc_info=e, invoice_id=invoice_id)
+                content = await storage_breaker.call_sync(
+                    self.client.storage.from_(settings.SUPABASE_STORAGE_BUCKET).download,
+                    storage_path
+                )
                 async with aiofiles.open(temp_file.name, 'wb') as f:
-                    await f.write(response.content)
-                
-                return temp_file.name
+                    await f.write(content)
+            
+            # Read before caching; once cached the file may be evicted at any time
+            async with aiofiles.open(temp_file.name, 'rb') as f:
+                content = await f.read()
+            if invoice_id:
+                await asyncio.to_thread(pdf_cache.put, invoice_id, temp_file.name)
+            else:
+                os.remove(temp_file.name)
+            return content
                 
         except Exception as e:
-            print(f"Error downloading PDF: {e}")
+            log_event(logger, "storage.download_failed", logging.ERROR, exc_info=e, invoice_id=invoice_id)
             raise
     
+    def _storage_path_from_url(self, pdf_url: str) -> Optional[str]:
+        """Object path inside the invoices bucket for one of its public URLs"""
+        marker = f"/object/public/{settings.SUPABASE_STORAGE_BUCKET}/"
+        if marker not in pdf_url:
+            return None
+        return pdf_url.split(marker, 1)[1].split('?', 1)[0]
+    
+    async def find_invoice(
+        self,
+        organization_id: str,
+        customer_id: str,
+        period_start: date,
+        period_end: date
+    ) -> Optional[str]:
+        """Id of an invoice already saved for the customer and period, if any"""
+        response = await self._execute(
+            self.client.table("rental_invoices")
+            .select("id")
+            .eq("organization_id", organization_id)
+            .eq("customer_id", customer_id)
+            .eq("invoice_period_start", period_start.isoformat())
+            .eq("invoice_period_end", period_end.isoformat())
+            .limit(1)
+        )
+        return response.data[0]['id'] if response.data else None
+    
+    async def billable_customers(
+        self,
+        organization_id: str,
+        period_end: date
+    ) -> List[str]:
+        """Customers with active rentals started by period end, the same set get_invoice_data bills"""
+        customer_ids = set()
+        offset = 0
+        while True:
+            page = await self._execute(
+                self.client.table("rentals")
+                .select("id, customer_id")
+                .eq("organization_id", organization_id)
+                .eq("status", "active")
+                .lte("rental_start_date", period_end.isoformat())
+                .order("id")
+                .range(offset, offset + PAGE_SIZE - 1)
+            )
+            rows = page.data or []
+            customer_ids.update(r['customer_id'] for r in rows if r.get('customer_id'))
+            if len(rows) < PAGE_SIZE:
+                return sorted(customer_ids)
+            offset += PAGE_SIZE
+    
     async def save_invoice(
         self,
         organization_id: str,
-        invoice_data: Dict[str, Any],
+        invoice_data: InvoiceData,
         template_id: Optional[str],
         pdf_url: str,
-        user_id: str
+        user_id: str,
+        pdf_sha256: Optional[str] = None
     ) -> str:
         """Save or update invoice record"""
         try:
-            invoice_record = {
-                'organization_id': organization_id,
-                'invoice_number': invoice_data['invoice_number'],
-                'customer_id': invoice_data['customer_id'],
-                'customer_name': invoice_data['customer_name'],
-                'customer_address': invoice_data.get('customer_address'),
-                'customer_email': invoice_data.get('customer_email'),
-                'invoice_date': invoice_data['invoice_date'],
-                'invoice_period_start': invoice_data['invoice_period_start'],
-                'invoice_period_end': invoice_data['invoice_period_end'],
-                'subtotal': invoice_data['subtotal'],
-                'tax_amount': invoice_data['tax_amount'],
-                'total_amount': invoice_data['total_amount'],
-                'pdf_url': pdf_url,
-                'template_id': template_id,
-                'status': 'draft',
-                'created_by': user_id
-            }
+            invoice_record = invoice_data.to_record(organization_id, template_id, pdf_url, user_id, pdf_sha256)
             
             # Check if invoice exists
-            existing = self.client.table("rental_invoices").select("id").eq("invoice_number", invoice_data['invoice_number']).eq("organization_id", organization_id).execute()
+            existing = await self._execute(self.client.table("rental_invoices").select("id").eq("invoice_number", invoice_data.invoice_number).eq("organization_id", organization_id))
             
             if existing.data and len(existing.data) > 0:
                 # Update existing
                 invoice_id = existing.data[0]['id']
-                self.client.table("rental_invoices").update(invoice_record).eq("id", invoice_id).execute()
+                await self._execute(self.client.table("rental_invoices").update(invoice_record).eq("id", invoice_id))
             else:
                 # Create new
-                response = self.client.table("rental_invoices").insert(invoice_record).execute()
+                response = await self._execute(self.client.table("rental_invoices").insert(invoice_record))
                 invoice_id = response.data[0]['id'] if response.data else None
             
             # Save line items
             if invoice_id:
                 # Delete existing line items
-                self.client.table("invoice_line_items").delete().eq("invoice_id", invoice_id).execute()
+                await self._execute(self.client.table("invoice_line_items").delete().eq("invoice_id", invoice_id))
                 
                 # Insert new line items
-                line_items = []
-                for item in invoice_data.get('line_items', []):
-                    line_items.append({
-                        'invoice_id': invoice_id,
-                        'line_type': 'rental',
-                        'description': item.get('description', ''),
-                        'cylinder_id': item.get('cylinder_id'),
-                        'barcode': item.get('barcode', ''),
-                        'rental_start_date': item.get('rental_start_date'),
-                        'rental_days': item.get('rental_days'),
-                        'quantity': item.get('quantity', 1),
-                        'unit_price': item.get('unit_price', 0),
-                        'total_price': item.get('total_price', 0)
-                    })
+                line_items = [item.to_row(invoice_id) for item in invoice_data.line_items]
                 
                 if line_items:
-                    self.client.table("invoice_line_items").insert(line_items).execute()
+                    await self._execute(self.client.table("invoice_line_items").insert(line_items))
             
             return invoice_id
             
         except Exception as e:
-            print(f"Error saving invoice: {e}")
+            log_event(logger, "supabase.save_invoice_failed", logging.ERROR, exc_info=e, invoice_number=invoice_data.invoice_number)
             raise
     
     async def update_invoice_status(
@@ -318,9 +425,9 @@ class SupabaseService:
             elif status == 'paid':
                 update_data['paid_at'] = datetime.now().isoformat()
             
-            self.client.table("rental_invoices").update(update_data).eq("id", invoice_id).execute()
+            await self._execute(self.client.table("rental_invoices").update(update_data).eq("id", invoice_id))
             
         except Exception as e:
-            print(f"Error updating invoice status: {e}")
+            log_event(logger, "supabase.status_update_failed", logging.ERROR, exc_info=e, invoice_id=invoice_id, status=status)
             raise
 
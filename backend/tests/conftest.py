@@ -0,0 +1,10 @@
+"""
+Settings need Supabase credentials at import time; point local stores at a temp dir
+"""
+import os
+import tempfile
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "test")
+os.environ.setdefault("LOCAL_DATA_DIR", tempfile.mkdtemp(prefix="invoice_api_tests_"))
@@ -0,0 +1,54 @@
+"""
+Per-organization admission: caps keep room for other tenants without idling slots
+"""
+import asyncio
+
+from backend.services.admission import AdmissionController, BATCH
+
+
+def make_controller():
+    return AdmissionController(
+        max_concurrent=2,
+        max_queue=16,
+        queue_timeout=5.0,
+        retry_after=5,
+        tenant_max_concurrent=1
+    )
+
+
+def test_lone_tenant_uses_every_slot():
+    controller = make_controller()
+
+    async def scenario():
+        await controller.acquire(BATCH, "large")
+        await controller.acquire(BATCH, "large")
+        return controller.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats['active'] == 2
+    assert stats['tenants']['large']['active'] == 2
+
+
+def test_cap_hands_freed_slot_to_waiting_tenant():
+    controller = make_controller()
+
+    async def scenario():
+        order = []
+
+        async def render(tenant):
+            await controller.acquire(BATCH, tenant)
+            order.append(tenant)
+
+        await render("large")
+        await render("large")
+        # Queued in this order; the large tenant is over its cap while small waits
+        waiting = [asyncio.create_task(render(t)) for t in ("large", "small")]
+        await asyncio.sleep(0)
+
+        controller.release("large")
+        await asyncio.sleep(0)
+        controller.release("large")
+        await asyncio.gather(*waiting)
+        return order
+
+    assert asyncio.run(scenario()) == ["large", "large", "small", "large"]
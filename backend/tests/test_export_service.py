@@ -0,0 +1,145 @@
+"""
+Streaming export: CSV cursors resume exactly after the last row received
+"""
+import asyncio
+import csv
+import io
+import json
+from datetime import date
+
+from backend.services.export_service import InvoiceExporter, decode_cursor, CSV, NDJSON
+
+
+class FakeQuery:
+    """Just enough of the postgrest query builder for InvoiceExporter.fetch_page"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.limit_count = None
+
+    def select(self, *args):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row[column] >= value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda row: row[column] <= value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row[column] > value)
+        return self
+
+    def order(self, column):
+        self.rows = sorted(self.rows, key=lambda row: row[column])
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def execute(self):
+        rows = [row for row in self.rows if all(f(row) for f in self.filters)]
+        return type("Response", (), {"data": rows[:self.limit_count]})()
+
+
+class FakeClient:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        return FakeQuery(self.rows)
+
+
+def make_invoices():
+    invoices = []
+    for i in range(5):
+        invoices.append({
+            'id': f"inv-{i}",
+            'organization_id': 'org-1',
+            'invoice_number': f"INV-{i}",
+            'invoice_date': '2025-01-15',
+            'total_amount': 100.0 * i,
+            # Returned out of order on purpose; the exporter sorts line items by id
+            'invoice_line_items': [
+                {'id': f"inv-{i}-line-{j}", 'description': f"Cylinder {j}", 'total_price': 10.0}
+                for j in reversed(range(i))
+            ]
+        })
+    return invoices
+
+
+def run_export(client, export_format, cursor=None, stop_after=None):
+    exporter = InvoiceExporter(client, page_size=2)
+
+    async def collect():
+        rows = []
+        async for row in exporter.stream(
+            organization_id='org-1',
+            start_date=date(2025, 1, 1),
+            end_date=date(2025, 1, 31),
+            export_format=export_format,
+            cursor=cursor
+        ):
+            rows.append(row)
+            if stop_after is not None and len(rows) == stop_after:
+                break
+        return rows
+
+    return asyncio.run(collect())
+
+
+def parse_csv(rows):
+    return list(csv.DictReader(io.StringIO("".join(rows))))
+
+
+def line_keys(records):
+    return [(r['invoice_id'], r['line_id']) for r in records]
+
+
+def test_csv_export_covers_every_line_item():
+    records = parse_csv(run_export(FakeClient(make_invoices()), CSV))
+
+    # Invoice 0 has no line items but still gets one row
+    assert len(records) == 1 + sum(range(5))
+    assert records[0]['invoice_id'] == 'inv-0' and records[0]['line_id'] == ''
+
+
+def test_csv_resume_mid_invoice_loses_no_line_items():
+    client = FakeClient(make_invoices())
+    full = parse_csv(run_export(client, CSV))
+
+    # Header, invoices 0-2 (1 + 1 + 2 rows), then 2 of invoice 3's 3 line items
+    partial = parse_csv(run_export(client, CSV, stop_after=1 + 4 + 2))
+    assert partial[-1]['invoice_id'] == 'inv-3'
+    assert decode_cursor(partial[-1]['cursor']) == ('inv-3', 2)
+
+    resumed = parse_csv(run_export(client, CSV, cursor=decode_cursor(partial[-1]['cursor'])))
+    assert resumed[0]['line_id'] == 'inv-3-line-2'
+    assert line_keys(partial) + line_keys(resumed) == line_keys(full)
+
+
+def test_csv_resume_after_last_line_item_starts_next_invoice():
+    client = FakeClient(make_invoices())
+    partial = parse_csv(run_export(client, CSV, stop_after=1 + 4))
+    assert decode_cursor(partial[-1]['cursor']) == ('inv-2', None)
+
+    resumed = parse_csv(run_export(client, CSV, cursor=decode_cursor(partial[-1]['cursor'])))
+    assert resumed[0]['invoice_id'] == 'inv-3' and resumed[0]['line_id'] == 'inv-3-line-0'
+
+
+def test_ndjson_resume_after_invoice():
+    client = FakeClient(make_invoices())
+    partial = run_export(client, NDJSON, stop_after=2)
+    cursor = decode_cursor(json.loads(partial[-1])['cursor'])
+    resumed = [json.loads(line) for line in run_export(client, NDJSON, cursor=cursor)]
+
+    assert cursor == ('inv-1', None)
+    assert [invoice['id'] for invoice in resumed] == ['inv-2', 'inv-3', 'inv-4']
@@ -0,0 +1,71 @@
+"""
+Invoice number allocation: no gaps from failed invoices, retryable exhaustion
+"""
+import asyncio
+
+import pytest
+
+from backend.services.errors import ServiceUnavailable
+from backend.services.invoice_numbers import InvoiceNumberAllocator
+
+
+class FakeSettingsTable:
+    """invoice_settings whose compare-and-swap fails `conflicts` times before succeeding"""
+
+    def __init__(self, conflicts=0):
+        self.next_invoice_number = 1
+        self.conflicts = conflicts
+        self.pending_update = None
+
+    def select(self, *args):
+        self.pending_update = None
+        return self
+
+    def update(self, values):
+        self.pending_update = values
+        return self
+
+    def eq(self, *args):
+        return self
+
+    def limit(self, *args):
+        return self
+
+    def execute(self):
+        if self.pending_update is None:
+            row = {'invoice_prefix': 'INV-', 'next_invoice_number': self.next_invoice_number}
+            return type("Response", (), {"data": [row]})()
+        if self.conflicts:
+            self.conflicts -= 1
+            return type("Response", (), {"data": []})()
+        self.next_invoice_number = self.pending_update['next_invoice_number']
+        return type("Response", (), {"data": [{'invoice_prefix': 'INV-'}]})()
+
+
+class FakeClient:
+    def __init__(self, table):
+        self._table = table
+
+    def table(self, name):
+        return self._table
+
+
+def test_released_number_goes_to_the_next_invoice():
+    allocator = InvoiceNumberAllocator(block_size=10)
+    client = FakeClient(FakeSettingsTable())
+
+    async def scenario():
+        first = await allocator.next_number(client, 'org-1')
+        failed = await allocator.next_number(client, 'org-1')
+        allocator.release('org-1', failed)
+        return first, await allocator.next_number(client, 'org-1'), await allocator.next_number(client, 'org-1')
+
+    assert asyncio.run(scenario()) == ('INV-000001', 'INV-000002', 'INV-000003')
+
+
+def test_exhausted_compare_and_swap_is_retryable():
+    allocator = InvoiceNumberAllocator(block_size=10)
+    client = FakeClient(FakeSettingsTable(conflicts=100))
+
+    with pytest.raises(ServiceUnavailable):
+        asyncio.run(allocator.next_number(client, 'org-1'))
@@ -0,0 +1,97 @@
+"""
+Email outbox: retrying the invoice status update after SMTP delivery
+"""
+import sqlite3
+
+from backend.services import outbox as outbox_module
+from backend.services.outbox import EmailOutbox, DELIVERED, FAILED, PENDING, SENT
+
+
+def make_outbox(tmp_path, status_max_attempts=3, max_attempts=8):
+    return EmailOutbox(
+        db_path=str(tmp_path / "outbox.sqlite3"),
+        max_attempts=max_attempts,
+        backoff_base=0.0,
+        backoff_max=0.0,
+        lease_seconds=300.0,
+        status_max_attempts=status_max_attempts,
+        retention_seconds=3600.0
+    )
+
+
+def enqueue(outbox, invoice_id):
+    message_id = outbox.enqueue('org-1', invoice_id, 'INV-1', 'a@example.com', 'Invoice', 'Body', b'%PDF')
+    outbox.claim_due(10)
+    outbox.mark_delivered(message_id)
+    return message_id
+
+
+def statuses(outbox):
+    return outbox.get_stats()['counts']
+
+
+def test_status_update_retries_are_capped(tmp_path):
+    outbox = make_outbox(tmp_path)
+    message_id = enqueue(outbox, 'inv-1')
+
+    assert outbox.mark_status_retry(message_id, 'inv-1', "timeout")
+    assert outbox.mark_status_retry(message_id, 'inv-1', "timeout")
+    assert statuses(outbox) == {DELIVERED: 1}
+
+    assert not outbox.mark_status_retry(message_id, 'inv-1', "timeout")
+    assert statuses(outbox) == {FAILED: 1}
+
+
+def test_status_update_budget_is_shared_by_an_invoice(tmp_path):
+    outbox = make_outbox(tmp_path)
+    first = enqueue(outbox, 'inv-1')
+    resend = enqueue(outbox, 'inv-1')
+    other = enqueue(outbox, 'inv-2')
+
+    assert outbox.mark_status_retry(first, 'inv-1', "timeout")
+    assert outbox.mark_status_retry(resend, 'inv-1', "timeout")
+    assert not outbox.mark_status_retry(first, 'inv-1', "timeout")
+    # Another invoice still has its own budget
+    assert outbox.mark_status_retry(other, 'inv-2', "timeout")
+
+
+def test_status_update_success_resets_the_invoice_budget(tmp_path):
+    outbox = make_outbox(tmp_path)
+    message_id = enqueue(outbox, 'inv-1')
+
+    outbox.mark_status_retry(message_id, 'inv-1', "timeout")
+    outbox.mark_status_retry(message_id, 'inv-1', "timeout")
+    outbox.mark_sent(message_id, 'inv-1')
+    assert statuses(outbox) == {SENT: 1}
+
+    resend = enqueue(outbox, 'inv-1')
+    assert outbox.mark_status_retry(resend, 'inv-1', "timeout")
+
+
+def attachments(outbox):
+    conn = sqlite3.connect(outbox.db_path)
+    try:
+        return dict(conn.execute("SELECT status, pdf IS NOT NULL FROM email_outbox").fetchall())
+    finally:
+        conn.close()
+
+
+def test_terminal_rows_drop_attachments_and_are_purged(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(outbox_module.time, 'time', lambda: now[0])
+    outbox = make_outbox(tmp_path, max_attempts=1)
+
+    sent = enqueue(outbox, 'inv-1')
+    outbox.mark_sent(sent, 'inv-1')
+    failed = outbox.enqueue('org-1', 'inv-2', 'INV-2', 'a@example.com', 'Invoice', 'Body', b'%PDF')
+    outbox.claim_due(10)
+    outbox.mark_retry(failed, 0, "550 mailbox unavailable")
+    outbox.enqueue('org-1', 'inv-3', 'INV-3', 'a@example.com', 'Invoice', 'Body', b'%PDF')
+
+    assert attachments(outbox) == {SENT: 0, FAILED: 0, PENDING: 1}
+
+    # Within retention nothing goes; after it only the terminal rows do
+    assert outbox.purge() == 0
+    now[0] += 3600 + 1
+    assert outbox.purge() == 2
+    assert statuses(outbox) == {PENDING: 1}
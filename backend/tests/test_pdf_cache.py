@@ -0,0 +1,64 @@
+"""
+PDF cache: adopting files left on disk by an earlier index, and hit bookkeeping
+"""
+import os
+
+from backend.services import pdf_cache as pdf_cache_module
+from backend.services.pdf_cache import PDFCache
+
+
+def write_pdf(cache_dir, invoice_id, content_hash, size, mtime):
+    path = os.path.join(cache_dir, f"{invoice_id}.{content_hash}.pdf")
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_adopt_removes_replaced_files_and_evicts(tmp_path):
+    cache_dir = str(tmp_path)
+    old = write_pdf(cache_dir, 'inv-1', 'aaa', 100, 1000)
+    current = write_pdf(cache_dir, 'inv-1', 'bbb', 100, 2000)
+    oldest = write_pdf(cache_dir, 'inv-2', 'ccc', 100, 500)
+    newest = write_pdf(cache_dir, 'inv-3', 'ddd', 100, 3000)
+
+    cache = PDFCache(cache_dir, max_bytes=250)
+    stats = cache.get_stats()
+
+    # The older file for inv-1 is replaced, then the least recently used goes
+    assert not os.path.exists(old)
+    assert not os.path.exists(oldest)
+    assert cache.get('inv-1', 'bbb') == b'x' * 100
+    assert cache.get('inv-3') == b'x' * 100
+    assert os.path.exists(current) and os.path.exists(newest)
+    assert (stats['entries'], stats['bytes']) == (2, 200)
+
+
+def test_hits_touch_accessed_at_at_most_once_per_interval(tmp_path, monkeypatch):
+    source = tmp_path / "render.pdf"
+    source.write_bytes(b'%PDF')
+    cache = PDFCache(str(tmp_path / "cache"), max_bytes=1024)
+    now = [1000.0]
+    monkeypatch.setattr(pdf_cache_module.time, 'time', lambda: now[0])
+    cache.put('inv-1', str(source), 'hash')
+
+    def accessed_at():
+        return cache._connect().execute("SELECT accessed_at FROM pdf_cache").fetchone()[0]
+
+    now[0] += 1
+    assert cache.get('inv-1', 'hash')
+    assert accessed_at() == 1000.0
+
+    now[0] += pdf_cache_module.TOUCH_INTERVAL_SECONDS
+    assert cache.get('inv-1', 'hash')
+    assert accessed_at() == now[0]
+
+
+def test_file_evicted_by_another_worker_is_a_miss(tmp_path):
+    source = tmp_path / "render.pdf"
+    source.write_bytes(b'%PDF')
+    cache = PDFCache(str(tmp_path / "cache"), max_bytes=1024)
+    os.remove(cache.put('inv-1', str(source), 'hash'))
+
+    assert cache.get('inv-1', 'hash') is None
+    assert cache.get_stats()['misses'] == 1
@@ -0,0 +1,264 @@
+"""
+Off-peak invoice scheduler driven by a simulated clock
+"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from backend.config import settings
+from backend.services.scheduler import (
+    InvoiceScheduler, ScheduleJob, ScheduleStore, SimulatedClock, DONE, FAILED, GENERATED, PENDING
+)
+
+LEASE_SECONDS = 600.0
+POLL_SECONDS = 60.0
+
+
+class Crash(BaseException):
+    """Stands in for the worker dying mid-item; nothing in the scheduler catches it"""
+
+
+class FakePipeline:
+    """Records calls in a shared ledger; `crash_after` kills the worker at a chosen step"""
+
+    def __init__(self, ledger, crash_after=None):
+        self.ledger = ledger
+        self.crash_after = crash_after
+
+    async def find_invoice(self, organization_id, customer_id, period_start, period_end):
+        return self.ledger['saved'].get((customer_id, period_start))
+
+    async def generate_invoice(self, organization_id, customer_id, period_start, period_end, **kwargs):
+        invoice_id = f"inv-{customer_id}-{len(self.ledger['generated'])}"
+        self.ledger['generated'].append(customer_id)
+        self.ledger['saved'][(customer_id, period_start)] = invoice_id
+        if self.crash_after == 'save':
+            raise Crash()
+        return {'invoice_id': invoice_id}
+
+    async def queue_invoice_email(self, organization_id, invoice_id, template_id=None):
+        if self.crash_after == 'email':
+            raise Crash()
+        self.ledger['queued'].append(invoice_id)
+
+
+@pytest.fixture(autouse=True)
+def no_accruals(monkeypatch):
+    monkeypatch.setattr(settings, 'RENTAL_ACCRUALS_ENABLED', False)
+
+
+@pytest.fixture
+def ledger():
+    return {'generated': [], 'saved': {}, 'queued': []}
+
+
+def make_scheduler(tmp_path, clock, ledger, customers, crash_after=None):
+    store = ScheduleStore(str(tmp_path / "scheduler.sqlite3"), lease_seconds=LEASE_SECONDS)
+    scheduler = InvoiceScheduler(
+        store=store,
+        jobs=[],
+        user_id="user-1",
+        poll_interval=POLL_SECONDS,
+        max_attempts=3,
+        clock=clock,
+        pipeline_factory=lambda: FakePipeline(ledger, crash_after)
+    )
+
+    async def billable_customers(organization_id, period_end):
+        return list(customers)
+
+    scheduler._billable_customers = billable_customers
+    return scheduler
+
+
+def make_job(**overrides):
+    config = {
+        'organization_id': 'org-1',
+        'window_start': '01:00',
+        'window_end': '05:00',
+        'max_per_minute': 30,
+        'day_of_month': 1,
+        'send': True
+    }
+    config.update(overrides)
+    return ScheduleJob.from_config(config)
+
+
+def at(hour, minute=0, day=1):
+    return datetime(2025, 2, day, hour, minute, tzinfo=timezone.utc)
+
+
+def tick(scheduler, job):
+    return asyncio.run(scheduler.tick(job))
+
+
+def test_window_close_handles_windows_across_midnight():
+    job = make_job(window_start='22:00', window_end='04:00')
+
+    assert job.window_close(at(23)) == at(4, day=2)
+    assert job.window_close(at(2)) == at(4)
+    assert job.window_close(at(4)) is None
+    assert job.window_close(at(21, 59)) is None
+
+
+def test_no_work_outside_the_window(tmp_path, ledger):
+    clock = SimulatedClock(at(0, 59))
+    scheduler = make_scheduler(tmp_path, clock, ledger, ['c1', 'c2'])
+    job = make_job()
+
+    assert tick(scheduler, job) == POLL_SECONDS
+    assert ledger['generated'] == []
+
+    clock.advance(60)
+    tick(scheduler, job)
+    assert ledger['generated'] == ['c1']
+
+    # The window closes at 05:00; the remaining customer waits for tomorrow's window
+    clock.set(at(5))
+    assert tick(scheduler, job) == POLL_SECONDS
+    assert ledger['generated'] == ['c1']
+
+    clock.set(at(1, day=2))
+    tick(scheduler, job)
+    assert ledger['generated'] == ['c1', 'c2']
+    assert ledger['queued'] == ['inv-c1-0', 'inv-c2-1']
+
+
+def test_rate_limit_caps_invoices_per_minute(tmp_path, ledger):
+    clock = SimulatedClock(at(1))
+    customers = [f"c{i:04d}" for i in range(500)]
+    scheduler = make_scheduler(tmp_path, clock, ledger, customers)
+    job = make_job(max_per_minute=4, window_end='02:00')
+
+    per_minute = {}
+    while clock.now() < at(2):
+        before = len(ledger['generated'])
+        delay = tick(scheduler, job)
+        if len(ledger['generated']) > before:
+            minute = clock.now().replace(second=0, microsecond=0)
+            per_minute[minute] = per_minute.get(minute, 0) + 1
+        clock.advance(delay)
+
+    # More work than the window allows: paced exactly at the limit, never above it
+    assert max(per_minute.values()) <= 4
+    assert len(ledger['generated']) == 4 * 60
+
+
+def test_workers_sharing_a_store_do_not_multiply_the_rate(tmp_path, ledger):
+    clock = SimulatedClock(at(1))
+    customers = [f"c{i:04d}" for i in range(500)]
+    workers = [make_scheduler(tmp_path, clock, ledger, customers) for _ in range(3)]
+    job = make_job(max_per_minute=4, window_end='02:00')
+
+    # Each worker ticks on its own schedule, as separate processes would
+    next_tick = [clock.now()] * len(workers)
+    while clock.now() < at(2):
+        for i, worker in enumerate(workers):
+            if next_tick[i] <= clock.now():
+                next_tick[i] = clock.now() + timedelta(seconds=tick(worker, job))
+        clock.set(min(next_tick))
+
+    assert len(ledger['generated']) == 4 * 60
+
+
+def test_work_is_spread_over_the_window(tmp_path, ledger):
+    clock = SimulatedClock(at(1))
+    scheduler = make_scheduler(tmp_path, clock, ledger, ['c1', 'c2', 'c3'])
+    job = make_job()
+
+    delays = []
+    generated_at = []
+    while len(ledger['generated']) < 3:
+        generated_at.append(clock.now())
+        delays.append(tick(scheduler, job))
+        clock.advance(delays[-1])
+
+    # Four hours for three invoices: 80 minutes apart rather than back to back
+    assert delays[0] == pytest.approx(timedelta(hours=4).total_seconds() / 3)
+    assert generated_at == [at(1), at(2, 20), at(3, 40)]
+
+
+def test_resume_after_crash_between_save_and_record_does_not_duplicate(tmp_path, ledger):
+    clock = SimulatedClock(at(1))
+    job = make_job()
+    crashing = make_scheduler(tmp_path, clock, ledger, ['c1'], crash_after='save')
+
+    with pytest.raises(Crash):
+        tick(crashing, job)
+    assert ledger['generated'] == ['c1']
+
+    # A fresh worker on the same store picks the item up once the lease lapses
+    restarted = make_scheduler(tmp_path, clock, ledger, ['c1'])
+    clock.advance(60)
+    assert tick(restarted, job) == POLL_SECONDS
+
+    clock.advance(LEASE_SECONDS)
+    tick(restarted, job)
+    assert ledger['generated'] == ['c1']
+    assert ledger['queued'] == ['inv-c1-0']
+    assert restarted.store.get_stats()['items'] == {DONE: 1}
+
+
+def test_resume_after_crash_while_queueing_only_sends(tmp_path, ledger):
+    clock = SimulatedClock(at(1))
+    job = make_job()
+    crashing = make_scheduler(tmp_path, clock, ledger, ['c1'], crash_after='email')
+
+    with pytest.raises(Crash):
+        tick(crashing, job)
+    assert crashing.store.get_stats()['items'] == {GENERATED: 1}
+
+    restarted = make_scheduler(tmp_path, clock, ledger, ['c1'])
+    clock.advance(LEASE_SECONDS)
+    tick(restarted, job)
+    assert ledger['generated'] == ['c1']
+    assert ledger['queued'] == ['inv-c1-0']
+    assert restarted.store.get_stats()['items'] == {DONE: 1}
+
+
+def test_failed_item_is_retried_then_given_up(tmp_path, ledger):
+    clock = SimulatedClock(at(1))
+    job = make_job()
+    scheduler = make_scheduler(tmp_path, clock, ledger, ['c1'])
+
+    async def fail(*args, **kwargs):
+        raise RuntimeError("render failed")
+
+    scheduler.pipeline_factory = lambda: type("Failing", (FakePipeline,), {'generate_invoice': fail})(ledger)
+    for _ in range(3):
+        tick(scheduler, job)
+        clock.advance(60)
+
+    items = scheduler.store.get_stats()['items']
+    assert PENDING not in items
+    assert items == {FAILED: 1}
+
+
+def test_max_per_minute_must_be_positive():
+    with pytest.raises(ValueError):
+        make_job(max_per_minute=0)
+
+
+def test_day_of_month_must_exist_in_every_month():
+    with pytest.raises(ValueError):
+        make_job(day_of_month=31)
+    with pytest.raises(ValueError):
+        make_job(day_of_month=0)
+
+
+def test_every_month_is_due_on_the_last_allowed_day():
+    job = make_job(day_of_month=28)
+
+    periods = set()
+    day = date(2025, 1, 1)
+    while day.year == 2025:
+        period = job.due_period(day)
+        if period:
+            periods.add(period)
+        day += timedelta(days=1)
+
+    # Billing on the 28th reaches every month, including after 30-day months and February
+    assert sorted(start.month for start, _ in periods) == [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+    assert (date(2025, 4, 1), date(2025, 4, 30)) in periods
+    assert job.due_period(date(2025, 5, 27)) is None
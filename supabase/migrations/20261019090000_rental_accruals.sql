@@ -0,0 +1,50 @@
+-- Incremental daily rental accrual ledger for the invoice backend.
+-- One row per rental per day with the daily charge in effect that day, so
+-- invoice assembly sums precomputed accruals instead of recomputing every
+-- rental over the whole period at month end.
+
+CREATE TABLE IF NOT EXISTS public.rental_accruals (
+  rental_id uuid not null,
+  organization_id uuid not null,
+  customer_id text,
+  accrual_date date not null,
+  daily_rate numeric(14,6) not null,
+  amount numeric(14,6) not null,
+  created_at timestamptz default now(),
+  PRIMARY KEY (rental_id, accrual_date)
+);
+
+CREATE INDEX IF NOT EXISTS rental_accruals_org_customer_date_idx
+  ON public.rental_accruals (organization_id, customer_id, accrual_date);
+
+-- Last day accrued per rental; the accrual job resumes from here.
+CREATE TABLE IF NOT EXISTS public.rental_accrual_cursors (
+  rental_id uuid primary key,
+  organization_id uuid not null,
+  accrued_through date not null,
+  updated_at timestamptz default now()
+);
+
+ALTER TABLE public.rental_accruals ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.rental_accrual_cursors ENABLE ROW LEVEL SECURITY;
+
+-- Per-rental totals for an invoice period (service role only).
+CREATE OR REPLACE FUNCTION public.rental_accrual_totals(
+  p_organization_id uuid,
+  p_customer_id text,
+  p_period_start date,
+  p_period_end date
+)
+RETURNS TABLE (rental_id uuid, days integer, amount numeric)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT a.rental_id, COUNT(*)::integer AS days, SUM(a.amount) AS amount
+  FROM public.rental_accruals a
+  WHERE a.organization_id = p_organization_id
+    AND a.customer_id = p_customer_id
+    AND a.accrual_date BETWEEN p_period_start AND p_period_end
+  GROUP BY a.rental_id;
+$$;
+
+REVOKE ALL ON FUNCTION public.rental_accrual_totals(uuid, text, date, date) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,6 @@
+-- Version of the stored invoice PDF for the invoice backend's local PDF cache.
+-- Regenerating an invoice overwrites the same storage path, so the URL alone
+-- can't tell a worker that its cached copy is stale; the content hash can.
+
+ALTER TABLE public.rental_invoices
+  ADD COLUMN IF NOT EXISTS pdf_sha256 text;
@@ -0,0 +1,55 @@
+-- Invoice lines straight from the accrual ledger.
+-- Returns a customer's active rentals for a period with the bottle fields
+-- printed on the invoice and the days and amount accrued within the period,
+-- so invoice assembly is a single read instead of fetching every rental and
+-- then the ledger totals separately.
+
+CREATE OR REPLACE FUNCTION public.rental_invoice_lines(
+  p_organization_id uuid,
+  p_customer_id text,
+  p_period_start date,
+  p_period_end date
+)
+RETURNS TABLE (
+  rental_id uuid,
+  rental_start_date date,
+  rental_amount numeric,
+  billing_frequency text,
+  bottle_barcode text,
+  bottle_description text,
+  bottle_serial_number text,
+  accrued_days integer,
+  accrued_amount numeric
+)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT
+    r.id,
+    r.rental_start_date,
+    r.rental_amount,
+    r.billing_frequency,
+    r.bottle_barcode,
+    b.description,
+    b.serial_number,
+    COALESCE(a.days, 0),
+    COALESCE(a.amount, 0)
+  FROM public.rentals r
+  LEFT JOIN public.bottles b ON b.id = r.bottle_id
+  LEFT JOIN LATERAL (
+    SELECT COUNT(*)::integer AS days, SUM(x.amount) AS amount
+    FROM public.rental_accruals x
+    WHERE x.rental_id = r.id
+      AND x.accrual_date BETWEEN p_period_start AND p_period_end
+  ) a ON true
+  WHERE r.organization_id = p_organization_id
+    AND r.customer_id = p_customer_id
+    AND r.status = 'active'
+    AND r.rental_start_date <= p_period_end
+  ORDER BY r.id;
+$$;
+
+REVOKE ALL ON FUNCTION public.rental_invoice_lines(uuid, text, date, date) FROM PUBLIC, anon, authenticated;
+
+-- Superseded by rental_invoice_lines.
+DROP FUNCTION IF EXISTS public.rental_accrual_totals(uuid, text, date, date);